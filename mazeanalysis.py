@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Quality metrics for mazes, for picking mazes of the right difficulty out of a batch.
+
+The metrics work on the wall masks alone, so they take a Maze, a MappedMaze or a
+Maze.getState() dictionary, as returned by mazebatch.generate_many(..., packed=True).
+Counts and histograms over cells are done with bytes.translate and bytes.count, a whole maze
+per call, taking milliseconds for a million cells, and are all that is measured by default. The
+path metrics are two mazegen.breadthFirst searches, and the corridor lengths are found by walking
+every corridor. Both visit cells one at a time in Python, so they are slow, around a second or
+more for a million cells, and only measured when asked for.
+"""
+
+import re
+from collections import Counter
+
+from mazegen import Maze, Cell, ALL_WALLS, MappedMaze, unpackWalls
+
+# Number of open walls of a cell, by wall mask
+OPEN_COUNT = bytes(4 - bin(value & ALL_WALLS).count('1') for value in range(256))
+
+# Wall mask with the wall in a direction added
+SET_WALL = [bytes(value | 1 << direction for value in range(256)) for direction in range(4)]
+
+# Slow metrics that need more than counting, computed only when asked for. They cost seconds,
+# not milliseconds, for mazes of a million cells.
+PATH_METRICS = ('diameter', 'solutionLength', 'solutionShare')
+CORRIDOR_METRICS = ('corridorLengths',)
+
+
+def closedWalls(source):
+    """
+    :param source: Maze, MappedMaze or Maze.getState() dictionary
+    :return: (width, height, walls, start index, finish index) with walls a copy of the wall masks
+             whose outer boundary is closed, entrance and exit included, so no search can leave
+             the grid. start and finish are -1 if not known.
+    """
+    if isinstance(source, dict):
+        if source.get('topology', 'rect') != 'rect':
+            raise ValueError(f"Only rect mazes can be measured, not {source['topology']}")
+        width, height = source['width'], source['height']
+        walls = unpackWalls(source['walls'], width * height)
+        start, finish = source['start'], source['finish']
+    elif isinstance(source, MappedMaze):
+        width, height = source.width, source.height
+        walls = unpackWalls(source.map[source.payloadOffset:], width * height)
+        start, finish = source.start, source.finish
+    else:
+        if source.topology.name != 'rect':
+            raise ValueError(f'Only rect mazes can be measured, not {source.topology.name}')
+        width, height = source.width, source.height
+        walls = bytearray(source.wallBits)
+        start, finish = source.start, source.finish
+
+    walls[:width] = bytes(walls[:width]).translate(SET_WALL[Cell.NORTH])
+    walls[-width:] = bytes(walls[-width:]).translate(SET_WALL[Cell.SOUTH])
+    walls[::width] = bytes(walls[::width]).translate(SET_WALL[Cell.WEST])
+    walls[width - 1::width] = bytes(walls[width - 1::width]).translate(SET_WALL[Cell.EAST])
+
+    startIndex = -1 if start is None else start[0] * width + start[1]
+    finishIndex = -1 if finish is None else finish[0] * width + finish[1]
+    return width, height, walls, startIndex, finishIndex
+
+
+def stepOffsets(width):
+    """
+    :return: Index offset to the neighbour in each direction, in Cell direction order
+    """
+    return tuple(Cell.RELATIONSHIP[direction][0] * width + Cell.RELATIONSHIP[direction][1] for direction in range(4))
+
+
+def corridorTurns():
+    """
+    :return: Table from wall mask << 2 | heading into a cell with two open walls, to the heading
+             out of it through the other open wall
+    """
+    table = bytearray(1024)
+    for mask in range(256):
+        for heading in range(4):
+            for direction in range(4):
+                if not mask >> direction & 1 and direction != Cell.OPPOSITE[heading]:
+                    table[mask << 2 | heading] = direction
+                    break
+    return bytes(table)
+
+
+CORRIDOR_TURNS = corridorTurns()
+
+
+def corridorLengths(walls, width, degrees):
+    """
+    Follow every corridor, a chain of cells with exactly two open walls, from the junction or
+    dead end at one end to the one at the other. This visits every cell in a corridor once, in
+    Python, so it takes about a second for a million cells.
+
+    :param degrees: walls.translate(OPEN_COUNT)
+    :return: Counter of corridor length in cells. Neighbouring junctions count as a corridor of 0.
+    """
+    offsets = stepOffsets(width)
+    turns = CORRIDOR_TURNS
+    # The last cell of each corridor walked, which is the first cell going the other way
+    ends = bytearray(len(walls))
+    lengths = Counter()
+
+    for node in re.finditer(b'[^\x02]', degrees):
+        node = node.start()
+        cellWalls = walls[node]
+        for direction in range(4):
+            if cellWalls >> direction & 1:
+                continue
+            current = node + offsets[direction]
+            if ends[current]:
+                continue
+            length = 0
+            while degrees[current] == 2:
+                direction = turns[walls[current] << 2 | direction]
+                current += offsets[direction]
+                length += 1
+            if length:
+                ends[current - offsets[direction]] = 1
+            # A corridor straight between two nodes is found from both ends
+            if length or node < current:
+                lengths[length] += 1
+    return lengths
+
+
+def analyze(source, paths=False, corridors=False):
+    """
+    Measure a maze. By default only the counts, which take milliseconds for a million cells.
+
+    :param source: Maze, MappedMaze or Maze.getState() dictionary
+    :param paths: Include the metrics that need a search through the maze, PATH_METRICS. Slow,
+                  a second or more for a million cells.
+    :param corridors: Include the metrics that follow the corridors, CORRIDOR_METRICS. Slow,
+                      around half a second for a million cells.
+    :return: Dictionary of
+        cells           - number of cells
+        degrees         - number of cells with 0 to 4 open walls, as a list
+        deadEnds        - cells with one open wall
+        junctions       - cells with three or four open walls
+        loops           - walls opened beyond a spanning tree, 0 for a perfect maze
+        corridors       - passages between dead ends and junctions
+        corridorLengths - {length: count} of corridors, in cells between their ends
+        river           - average corridor length, higher for mazes of long winding passages
+        diameter        - cells on the longest shortest path in the maze. Exact for perfect
+                          mazes, at least this long with loops.
+        solutionLength  - cells on the shortest path from start to finish, 0 if none
+        solutionShare   - fraction of the cells on that path
+    """
+    width, height, walls, startIndex, finishIndex = closedWalls(source)
+    cells = width * height
+    degrees = walls.translate(OPEN_COUNT)
+    histogram = [degrees.count(degree) for degree in range(5)]
+    # Every opening is counted from the cells on both sides of it
+    openings = sum(degree * count for degree, count in enumerate(histogram)) // 2
+    # A corridor of n cells has n + 1 openings, so taking a cell off every corridor opening leaves
+    # one per corridor. A ring with no junction or dead end on it would count none, but a
+    # connected maze has one only if it is nothing else.
+    count = openings - histogram[2]
+    result = {
+        'cells': cells,
+        'degrees': histogram,
+        'deadEnds': histogram[1],
+        'junctions': histogram[3] + histogram[4],
+        'loops': openings - cells + 1,
+        'corridors': count,
+        'river': histogram[2] / count if count else float(histogram[2]),
+    }
+
+    if corridors:
+        result['corridorLengths'] = dict(sorted(corridorLengths(walls, width, degrees).items()))
+
+    if paths:
+        maze = Maze(width, height)
+        maze.wallBits[:] = walls
+        # The farthest cell from anywhere is one end of a longest path in a tree
+        distances = maze.distanceField(divmod(max(startIndex, 0), width))
+        solution = distances[finishIndex] if startIndex >= 0 and finishIndex >= 0 else -1
+        end = distances.index(max(distances))
+        diameter = max(maze.distanceField(divmod(end, width)))
+        result['diameter'] = diameter + 1
+        result['solutionLength'] = solution + 1 if solution >= 0 else 0
+        result['solutionShare'] = result['solutionLength'] / cells
+
+    return result
+
+
+def matches(metrics, ranges):
+    """
+    :param ranges: {metric: (minimum, maximum)}, either may be None for no limit
+    """
+    for name, (minimum, maximum) in ranges.items():
+        value = metrics[name]
+        if minimum is not None and value < minimum:
+            return False
+        if maximum is not None and value > maximum:
+            return False
+    return True
+
+
+def filterMazes(mazes, ranges):
+    """
+    Pick the mazes whose metrics are in range, measuring each maze once. Only the counts are
+    measured unless ranges name any of the slow PATH_METRICS or CORRIDOR_METRICS. Those cost
+    seconds per million cells of each maze, rather than milliseconds.
+
+    :param mazes: Iterable of anything analyze takes
+    :param ranges: {metric: (minimum, maximum)} as for matches, e.g. {'deadEnds': (None, 100)}
+    :return: Generator of (maze, metrics) for the mazes that match
+    """
+    paths = any(name in PATH_METRICS for name in ranges)
+    corridors = any(name in CORRIDOR_METRICS for name in ranges)
+    for maze in mazes:
+        metrics = analyze(maze, paths, corridors)
+        if matches(metrics, ranges):
+            yield maze, metrics
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Generate many mazes at once across a pool of worker processes.
+
+Every job gets its own random.Random(seed), so any maze in a batch can be reproduced
+from its spec alone, and results come back from the workers as Maze.getState()
+dictionaries rather than pickled Cell graphs.
+
+generate_tiled splits a single large maze into tiles that are carved in parallel.
+"""
+
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from mazegen import Maze, Cell, GENERATORS, packWalls, unpackWalls, runSteps
+
+
+def generateState(spec):
+    """
+    Generate a single maze in the worker process.
+
+    :param spec: dictionary with width and height, and optionally algorithm, seed, loops, deadEndsFirst,
+                 start, entrance, finish and exit_direction as taken by Maze.generate
+    :return: Maze.getState() of the result
+    """
+    maze = Maze(spec['width'], spec['height'])
+    maze.generate(spec.get('algorithm', 'backtracker'),
+                  start=spec.get('start', (0, 0)),
+                  entrance=spec.get('entrance', Cell.WEST),
+                  finish=spec.get('finish'),
+                  exit_direction=spec.get('exit_direction', Cell.EAST),
+                  loops=spec.get('loops', 0),
+                  seed=spec['seed'],
+                  deadEndsFirst=spec.get('deadEndsFirst', False))
+    return maze.getState()
+
+
+def seedSpecs(specs, seed=None):
+    """
+    Give every spec without a seed its own one, derived from seed and its position in the batch
+
+    :return: List of copies of the specs, each with a seed
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    seeded = []
+    for jobIndex, spec in enumerate(specs):
+        spec = dict(spec)
+        if spec.get('seed') is None:
+            spec['seed'] = (seed << 32) + jobIndex
+        seeded.append(spec)
+    return seeded
+
+
+def generate_many(specs, workers=None, seed=None, packed=False):
+    """
+    Generate a batch of mazes in parallel.
+
+    :param specs: Iterable of generation specs, see generateState
+    :param workers: Number of worker processes, os.cpu_count() by default. With 1 the mazes are
+                    generated in this process.
+    :param seed: Base seed for specs that don't give their own
+    :param packed: Yield Maze.getState() dictionaries instead of Maze objects
+    :return: Generator of results in the same order as specs
+    """
+    specs = seedSpecs(specs, seed)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(specs) <= 1:
+        states = map(generateState, specs)
+        for state in states:
+            yield state if packed else Maze.fromState(state)
+        return
+
+    chunksize = max(1, len(specs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for state in executor.map(generateState, specs, chunksize=chunksize):
+            yield state if packed else Maze.fromState(state)
+
+
+def generateTile(job):
+    """
+    Carve one tile of a tiled maze in the worker process. The tile has no entrance or exit,
+    its outer walls are left standing for the seams.
+
+    :param job: (width, height, algorithm, seed)
+    :return: Wall masks of the tile, packed two cells per byte
+    """
+    width, height, algorithm, seed = job
+    tile = Maze(width, height)
+    runSteps(GENERATORS[algorithm](tile, 0, random.Random(seed), tile.marks))
+    return packWalls(tile.wallBits)
+
+
+def generate_tiled(width, height, tileSize=512, workers=None, algorithm='backtracker', seed=None, loops=0,
+                   start=(0, 0), entrance=Cell.WEST, finish=None, exit_direction=Cell.EAST, deadEndsFirst=False):
+    """
+    Generate one large maze by carving square tiles in parallel and joining them.
+
+    Each tile is a perfect maze on its own. The tiles are then connected along a random spanning
+    tree of the tile grid, opening one seam wall per tree edge, so the result is again a single
+    spanning tree, before the entrance, exit and loops are added as in Maze.generate.
+
+    :return: The Maze, its algorithm recorded as 'tiled-<tileSize>-<algorithm>'. The same
+             arguments make the same maze again, whatever the number of workers.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    rng = random.Random(seed)
+    workers = workers or os.cpu_count() or 1
+
+    tileCols = -(-width // tileSize)
+    tileRows = -(-height // tileSize)
+    tiles = []
+    jobs = []
+    for tileRow in range(tileRows):
+        for tileCol in range(tileCols):
+            x, y = tileCol * tileSize, tileRow * tileSize
+            tileWidth, tileHeight = min(tileSize, width - x), min(tileSize, height - y)
+            tiles.append((x, y, tileWidth, tileHeight))
+            jobs.append((tileWidth, tileHeight, algorithm, rng.getrandbits(64)))
+
+    if workers == 1 or len(jobs) == 1:
+        results = map(generateTile, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(generateTile, jobs)
+
+    maze = Maze(width, height)
+    walls = maze.wallBits
+    try:
+        for (x, y, tileWidth, tileHeight), packed in zip(tiles, results):
+            tileWalls = unpackWalls(packed, tileWidth * tileHeight)
+            for row in range(tileHeight):
+                offset = (y + row) * width + x
+                walls[offset:offset + tileWidth] = tileWalls[row * tileWidth:(row + 1) * tileWidth]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    maze.marks.visitAll()
+
+    # Seams: (tile, neighbour tile, direction from tile to neighbour), joined Kruskal style
+    seams = [(tile, tile + 1, Cell.EAST) for tile in range(len(tiles)) if tile % tileCols < tileCols - 1]
+    seams += [(tile, tile + tileCols, Cell.SOUTH) for tile in range(len(tiles) - tileCols)]
+    rng.shuffle(seams)
+    parent = list(range(len(tiles)))
+
+    def root(tile):
+        while parent[tile] != tile:
+            parent[tile] = parent[parent[tile]]
+            tile = parent[tile]
+        return tile
+
+    for tileA, tileB, direction in seams:
+        rootA, rootB = root(tileA), root(tileB)
+        if rootA == rootB:
+            continue
+        parent[rootB] = rootA
+
+        x, y, tileWidth, tileHeight = tiles[tileA]
+        if direction == Cell.EAST:
+            row, col = y + rng.randrange(tileHeight), x + tileWidth - 1
+        else:
+            row, col = y + tileHeight - 1, x + rng.randrange(tileWidth)
+        maze.removeWallAt(row * width + col, direction)
+
+    # Not the maze Maze.generate(algorithm, seed=seed) would make, so the tiling is part of the name
+    maze.seed = seed
+    maze.algorithm = f'tiled-{tileSize}-{algorithm}'
+    maze.openEntrances(start, entrance, finish, exit_direction)
+    if loops:
+        maze.addLoops(loops, None, rng, deadEndsFirst)
+    return maze
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Benchmarks for the maze hot paths, with fixed seeds so runs can be compared.
+
+  python -m mazebench run -o baseline.json
+  python -m mazebench run --sizes 10 100 --cases generate/ solve/ -o current.json
+  python -m mazebench compare baseline.json current.json
+
+Each case is timed on square mazes of each size, keeping the best of a few runs, and then run
+once more under tracemalloc for its peak memory. The Qt case draws MazeWidget into an offscreen
+QImage and is skipped when PyQt5 isn't installed.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from mazegen import Maze, GENERATORS, SOLVERS, writePng
+
+SEED = 20200912
+SIZES = (10, 100, 1000, 4000)
+RESULTS_VERSION = 1
+
+# Kept here so it lives as long as the widgets drawn in it
+qtApplication = None
+
+
+def generated(size, algorithm='backtracker'):
+    maze = Maze(size, size)
+    maze.generate(algorithm, seed=SEED)
+    return maze
+
+
+def generateCase(algorithm, loops=False):
+    def setup(size):
+        maze = Maze(size, size)
+        count = max(1, size * size // 100) if loops else 0
+        return lambda: maze.generate(algorithm, loops=count, seed=SEED)
+    return setup
+
+
+def solveCase(algorithm):
+    def setup(size):
+        maze = generated(size)
+        return lambda: maze.solve(algorithm)
+    return setup
+
+
+def removeMarksCase(size):
+    maze = generated(size)
+    return maze.removeMarks
+
+
+def wallToucherCase(size):
+    maze = generated(size)
+    return maze.wallToucher
+
+
+def pngCase(size):
+    maze = generated(size)
+    return lambda: writePng(maze, io.BytesIO())
+
+
+def qtPaintCase(size):
+    """
+    Full repaint of MazeWidget, cache included, into an offscreen QImage
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QImage
+    from mazesqt import MazeWidget
+
+    global qtApplication
+    qtApplication = QApplication.instance() or QApplication([])
+    widget = MazeWidget(generated(size))
+    widget.resize(1000, 1000)
+    image = QImage(widget.size(), QImage.Format_RGB32)
+
+    def run():
+        widget.cache = None
+        widget.render(image)
+    return run
+
+
+def qtAvailable():
+    try:
+        import PyQt5.QtWidgets
+    except ImportError:
+        return False
+    return True
+
+
+# Name: (setup(size) returning the function to time, largest size worth running or None)
+CASES = {}
+for _algorithm in GENERATORS:
+    CASES['generate/' + _algorithm] = (generateCase(_algorithm), None)
+CASES['generate/backtracker+loops'] = (generateCase('backtracker', loops=True), None)
+for _algorithm in SOLVERS:
+    CASES['solve/' + _algorithm] = (solveCase(_algorithm), None)
+CASES['removeMarks'] = (removeMarksCase, None)
+CASES['wallToucher'] = (wallToucherCase, None)
+CASES['render/png'] = (pngCase, None)
+CASES['render/qt'] = (qtPaintCase, 1000)
+
+
+def measure(setup, size, repeat, memory=True):
+    """
+    :return: Result dictionary for one case and size
+    """
+    best = None
+    for _ in range(repeat):
+        run = setup(size)
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        run = setup(size)
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    cells = size * size
+    return {
+        'size': size,
+        'cells': cells,
+        'seconds': best,
+        'cellsPerSecond': cells / best if best else None,
+        'peakBytes': peak,
+    }
+
+
+def runCases(names, sizes, repeat=None, memory=True, report=None):
+    """
+    :param repeat: Runs to keep the best of, by default more for small mazes
+    :param report: Called with each result as it is measured
+    :return: Results document as written by the run command
+    """
+    results = []
+    for name in names:
+        setup, maxSize = CASES[name]
+        if name == 'render/qt' and not qtAvailable():
+            continue
+        for size in sizes:
+            if maxSize is not None and size > maxSize:
+                continue
+            count = repeat or max(1, min(5, 10 ** 6 // (size * size)))
+            result = dict(case=name, **measure(setup, size, count, memory))
+            results.append(result)
+            if report is not None:
+                report(result)
+
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'results': results,
+    }
+
+
+def compareResults(baseline, current, threshold=0.1, minSeconds=0.001):
+    """
+    :param threshold: Increase counted as a regression, 0.1 is 10%
+    :param minSeconds: Times this short are too noisy to count as regressions
+    :return: List of (case, size, measure, baseline value, current value, ratio, regressed) for
+             every case and size in both documents
+    """
+    before = {(result['case'], result['size']): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = before.get((result['case'], result['size']))
+        if old is None:
+            continue
+        for key in ('seconds', 'peakBytes'):
+            if not old.get(key) or result.get(key) is None:
+                continue
+            ratio = result[key] / old[key]
+            regressed = ratio > 1 + threshold and not (key == 'seconds' and result[key] < minSeconds)
+            rows.append((result['case'], result['size'], key, old[key], result[key], ratio, regressed))
+    return rows
+
+
+def formatResult(result):
+    peak = '-' if result['peakBytes'] is None else f"{result['peakBytes'] / 1024:.0f}k"
+    return (f"{result['case']:32} {result['size']:>6} {result['seconds']:10.4f}s "
+            f"{result['cellsPerSecond']:14,.0f} cells/s {peak:>10}")
+
+
+def runCommand(args):
+    names = [name for name in CASES if not args.cases or any(name.startswith(case) for case in args.cases)]
+    results = runCases(names, args.sizes, args.repeat, not args.no_memory, lambda result: print(formatResult(result)))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            return printComparison(compareResults(json.load(file), results, args.threshold))
+    return 0
+
+
+def compareCommand(args):
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    return printComparison(compareResults(baseline, current, args.threshold))
+
+
+def printComparison(rows):
+    """
+    :return: Exit status, 1 if anything regressed
+    """
+    regressions = 0
+    for case, size, key, old, new, ratio, regressed in rows:
+        regressions += regressed
+        print(f"{case:32} {size:>6} {key:10} {old:14.6g} {new:14.6g} {ratio:7.2f}x{'  REGRESSION' if regressed else ''}")
+    print(f"{regressions} regression{'' if regressions == 1 else 's'}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='mazebench', description='Benchmark maze generation, solving and drawing')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('run', help='Run the benchmarks')
+    command.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='Maze sizes, each used for width and height')
+    command.add_argument('--cases', nargs='+', help=f"Only cases starting with these, from {', '.join(CASES)}")
+    command.add_argument('--repeat', type=int, help='Runs to keep the best of')
+    command.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc runs')
+    command.add_argument('-o', '--output', help='Write the results to this JSON file')
+    command.add_argument('--baseline', help='Compare with the results in this JSON file')
+    command.add_argument('--threshold', type=float, default=0.1, help='Slow down counted as a regression, 0.1 is 10%%')
+    command.set_defaults(run=runCommand)
+
+    command = commands.add_parser('compare', help='Compare two results files')
+    command.add_argument('baseline')
+    command.add_argument('current')
+    command.add_argument('--threshold', type=float, default=0.1, help='Slow down counted as a regression, 0.1 is 10%%')
+    command.set_defaults(run=compareCommand)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Cache of generated mazes, keyed by a hash of every generation parameter.
+
+Only seeded mazes are cached, since only those can be generated again. Entries hold the maze
+packed as in Maze.getState(), with the solver paths and distance fields asked for so far. They
+are kept in a bounded in-memory LRU, and optionally in a directory of maze files that is trimmed
+back to a size limit, oldest used first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from mazegen import Maze, Cell, encodeHeader, decodeHeader, checkPayload
+from mazebatch import generateState
+
+# Part of every key, to be bumped when a generator changes what it makes for a given seed
+CACHE_VERSION = 1
+
+SPEC_DEFAULTS = {
+    'algorithm': 'backtracker',
+    'loops': 0,
+    'deadEndsFirst': False,
+    'start': (0, 0),
+    'entrance': Cell.WEST,
+    'finish': None,
+    'exit_direction': Cell.EAST,
+}
+
+
+def normalizeSpec(spec):
+    """
+    :param spec: Generation spec as for mazebatch.generateState, seed required
+    :return: Copy of spec with every parameter filled in
+    """
+    if spec.get('seed') is None:
+        raise ValueError('Only mazes with a seed can be cached')
+    normal = dict(SPEC_DEFAULTS)
+    normal.update((name, value) for name, value in spec.items() if value is not None)
+    if normal['finish'] is None:
+        normal['finish'] = (normal['height'] - 1, normal['width'] - 1)
+    normal['start'] = tuple(normal['start'])
+    normal['finish'] = tuple(normal['finish'])
+    return normal
+
+
+def specKey(spec):
+    """
+    :return: Hex digest naming the maze that spec generates
+    """
+    normal = normalizeSpec(spec)
+    normal['version'] = CACHE_VERSION
+    return hashlib.sha256(json.dumps(normal, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    """
+    A packed maze and the results worked out for it, by name such as 'solution-astar' or 'distances'
+    """
+
+    def __init__(self, state, results=None):
+        self.state = state
+        self.results = results or {}
+
+    def size(self):
+        return len(self.state['walls']) + sum(len(result) * result.itemsize for result in self.results.values())
+
+
+class MazeCache:
+    """
+    Thread safe, so one cache can serve every request of a service. Mazes are generated and read
+    from disk outside the lock, so hits wait only for the dictionary lookup, and each key is
+    generated by one thread at a time while any others asking for it wait.
+    """
+
+    def __init__(self, maxEntries=256, maxBytes=64 << 20, directory=None, maxDiskBytes=1 << 30):
+        """
+        :param maxEntries: Most entries kept in memory
+        :param maxBytes: Most bytes of walls and results kept in memory
+        :param directory: Where to keep entries on disk, None for memory only
+        :param maxDiskBytes: Size the directory is trimmed back to
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.maxDiskBytes = maxDiskBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        # Event set when the entry being made for a key is ready, by key
+        self.pending = {}
+        self.diskBytes = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def entry(self, spec):
+        """
+        :return: (key, CacheEntry) for spec, generating the maze if it isn't cached
+        """
+        key = specKey(spec)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return key, entry
+                ready = self.pending.get(key)
+                if ready is None:
+                    ready = self.pending[key] = threading.Event()
+                    break
+            # Another thread is making it. Look again once it is done, or has failed.
+            ready.wait()
+
+        try:
+            entry = self.loadEntry(key)
+            if entry is None:
+                entry = CacheEntry(generateState(normalizeSpec(spec)))
+                self.storeEntry(key, entry)
+                with self.lock:
+                    self.misses += 1
+            else:
+                with self.lock:
+                    self.hits += 1
+            with self.lock:
+                self.remember(key, entry)
+            return key, entry
+        finally:
+            with self.lock:
+                del self.pending[key]
+            ready.set()
+
+    def getState(self, spec):
+        """
+        :return: Maze.getState() of the maze for spec
+        """
+        return dict(self.entry(spec)[1].state)
+
+    def getMaze(self, spec):
+        """
+        :return: New Maze for spec, free to change
+        """
+        return Maze.fromState(self.entry(spec)[1].state)
+
+    def result(self, spec, name, compute):
+        """
+        :param compute: Called with the Maze to work out the result when it isn't cached
+        :return: Copy of the array('i') result called name for the maze of spec
+        """
+        key, entry = self.entry(spec)
+        with self.lock:
+            result = entry.results.get(name)
+            if result is None:
+                result = self.loadResult(key, name)
+                if result is not None:
+                    self.addResult(key, entry, name, result)
+        if result is None:
+            result = array('i', compute(Maze.fromState(entry.state)))
+            with self.lock:
+                self.addResult(key, entry, name, result)
+                self.storeResult(key, name, result)
+        return array('i', result)
+
+    def addResult(self, key, entry, name, result):
+        entry.results[name] = result
+        if key in self.entries:
+            self.bytes += len(result) * result.itemsize
+            self.trim()
+
+    def solution(self, spec, algorithm='astar'):
+        """
+        :return: Cell indexes on the path from start to finish, as Maze.solve
+        """
+        return self.result(spec, 'solution-' + algorithm, lambda maze: maze.solve(algorithm))
+
+    def distances(self, spec):
+        """
+        :return: Steps from the start to every cell, as Maze.distanceField
+        """
+        return self.result(spec, 'distances', lambda maze: maze.distanceField())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.bytes += entry.size()
+        self.trim()
+
+    def trim(self):
+        # The newest entry is always kept, even if it is bigger than maxBytes on its own
+        while len(self.entries) > 1 and (len(self.entries) > self.maxEntries or self.bytes > self.maxBytes):
+            _key, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size()
+
+    # On disk, each entry is a maze file named by its key, and a file for each result beside it
+
+    def path(self, key, name='maze'):
+        return os.path.join(self.directory, f'{key}.{name}')
+
+    def loadEntry(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            state, offset = decodeHeader(data)
+            checkPayload(state, len(data) - offset)
+        except ValueError:
+            # Cut short or damaged, made again by the caller
+            os.remove(self.path(key))
+            return None
+        state['walls'] = data[offset:]
+        # The modification time records when the entry was last used, for trimming
+        os.utime(self.path(key))
+        return CacheEntry(state)
+
+    def loadResult(self, key, name):
+        if self.directory is None:
+            return None
+        result = array('i')
+        try:
+            with open(self.path(key, name), 'rb') as file:
+                result.frombytes(file.read())
+        except FileNotFoundError:
+            return None
+        return result
+
+    def storeEntry(self, key, entry):
+        if self.directory is not None:
+            self.writeFile(key, self.path(key), encodeHeader(entry.state) + entry.state['walls'])
+
+    def storeResult(self, key, name, result):
+        if self.directory is not None and os.path.exists(self.path(key)):
+            self.writeFile(key, self.path(key, name), result.tobytes())
+
+    def writeFile(self, key, path, data):
+        # Written aside and renamed, so other processes never see half a file
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+        # The directory is only listed when the running total says it may be too big
+        with self.lock:
+            if self.diskBytes is None:
+                self.diskBytes = self.maxDiskBytes + 1
+            else:
+                self.diskBytes += len(data)
+            if self.diskBytes > self.maxDiskBytes:
+                self.diskBytes = self.trimDisk(key)
+
+    def trimDisk(self, keep):
+        """
+        Delete the least recently used entries, except keep, until the directory is within maxDiskBytes
+
+        :return: Bytes left in the directory
+        """
+        sizes = {}
+        used = {}
+        files = {}
+        for item in os.scandir(self.directory):
+            if item.name.endswith('.tmp'):
+                continue
+            key = item.name.split('.', 1)[0]
+            info = item.stat()
+            sizes[key] = sizes.get(key, 0) + info.st_size
+            files.setdefault(key, []).append(item.path)
+            if item.name.endswith('.maze'):
+                used[key] = info.st_mtime
+
+        total = sum(sizes.values())
+        for key in sorted(sizes, key=lambda key: used.get(key, 0)):
+            if total <= self.maxDiskBytes:
+                break
+            if key == keep:
+                continue
+            for path in files[key]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[key]
+        return total
@@ -2,9 +2,464 @@
 """
 Author: Shalom Crown
 Licence: GPL3
+
+The maze is stored as flat arrays, one byte per cell:
+  wallBits      - bit n set means the wall in direction n (Cell.EAST etc.) is standing
+
+Visited cells and walls touched by a traverser are marked in MarkLayers, by default maze.marks.
+Each layer is cleared in O(1) by starting a new epoch, and generation, solving and overlays can
+each mark their own layer without disturbing the others. visitedBits and traversedBits are
+copies of the default layer as plain arrays:
+  visitedBits   - non zero if the cell was visited
+  traversedBits - bit n set means the wall in direction n was touched by a traverser
+
+Cell objects are thin views on these arrays, created on demand by maze.cells[row][col].
+
+Which cells are next to which comes from the maze topology, see mazetopology. Generation and
+solving follow its precomputed neighbour index, so they work on every grid shape. Cell, the
+image writers and the maze file format are for the flat grids, with four directions.
+
+writePng, writePbm and writeSvg render a maze without any GUI, one row of cells at a time.
 """
 
+import heapq
+import logging
+import mmap
+import os
 import random
+import re
+import struct
+import time
+import zlib
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from itertools import compress, islice
+
+from mazetopology import getTopology
+
+log = logging.getLogger(__name__)
+
+ALL_WALLS = 0b1111
+
+# Maze file: fixed header, algorithm name, then the wall masks packed two cells per byte.
+# Missing start/finish positions and directions are stored as -1.
+FILE_MAGIC = b'MAZE'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHIIiibiibB16sB')
+
+
+LOW_NIBBLE = bytes(value & 0xf for value in range(256))
+HIGH_NIBBLE = bytes(value >> 4 for value in range(256))
+
+# Tables for bytes.translate over wall masks: 1 where the wall in a direction is standing. The
+# dead end tables are per topology, Topology.deadEnds.
+WALL_INK = [bytes(value >> direction & 1 for value in range(256)) for direction in range(8)]
+
+
+def packWalls(walls):
+    """
+    Pack 4 bit wall masks two to a byte, the first cell of each pair in the low nibble
+    """
+    low = walls[0::2]
+    high = walls[1::2]
+    # Nibbles never carry into the next byte, so the whole array can be combined as one integer
+    packed = int.from_bytes(low, 'little') | int.from_bytes(high, 'little') << 4
+    return packed.to_bytes(len(low), 'little')
+
+
+def unpackWalls(packed, count):
+    """
+    Inverse of packWalls for count cells
+    """
+    walls = bytearray(len(packed) * 2)
+    walls[0::2] = packed.translate(LOW_NIBBLE)
+    walls[1::2] = packed.translate(HIGH_NIBBLE)
+    del walls[count:]
+    return walls
+
+
+def encodeHeader(state):
+    """
+    :return: Maze file header for a Maze.getState() dictionary
+    """
+    start = state['start'] or (-1, -1)
+    finish = state['finish'] or (-1, -1)
+    entrance = -1 if state['entrance'] is None else state['entrance']
+    exit = -1 if state['exit'] is None else state['exit']
+    seed = state['seed']
+    if seed is not None and not isinstance(seed, int):
+        raise ValueError(f'Only integer seeds can be saved, not {seed!r}')
+    if seed is not None and not -(1 << 127) <= seed < 1 << 127:
+        raise ValueError(f'Only seeds that fit in 128 signed bits can be saved, not {seed}')
+    algorithm = (state['algorithm'] or '').encode('ascii')
+
+    return FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, FILE_HEADER.size + len(algorithm),
+                            state['width'], state['height'],
+                            start[0], start[1], entrance, finish[0], finish[1], exit,
+                            seed is not None, (seed or 0).to_bytes(16, 'little', signed=True),
+                            len(algorithm)) + algorithm
+
+
+def decodeHeader(data):
+    """
+    :param data: Start of a maze file, at least the whole header
+    :return: Maze.getState() dictionary without the walls, and the offset of the wall payload
+    """
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('Not a maze file' if data[:len(FILE_MAGIC)] != FILE_MAGIC[:len(data)] else 'Truncated maze file')
+    (magic, version, payloadOffset, width, height, startRow, startCol, entrance,
+     finishRow, finishCol, exit, hasSeed, seed, algorithmLength) = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC:
+        raise ValueError('Not a maze file')
+    if version > FILE_VERSION:
+        raise ValueError(f'Maze file version {version} is newer than supported version {FILE_VERSION}')
+
+    algorithm = bytes(data[FILE_HEADER.size:FILE_HEADER.size + algorithmLength]).decode('ascii')
+    state = {
+        'width': width,
+        'height': height,
+        'start': None if startRow < 0 else (startRow, startCol),
+        'entrance': None if entrance < 0 else entrance,
+        'finish': None if finishRow < 0 else (finishRow, finishCol),
+        'exit': None if exit < 0 else exit,
+        'seed': int.from_bytes(seed, 'little', signed=True) if hasSeed else None,
+        'algorithm': algorithm or None,
+    }
+    return state, payloadOffset
+
+
+def checkPayload(state, size):
+    """
+    :param size: Bytes of wall masks after the header, packed two cells per byte
+    :raises ValueError: If there are too few for the maze
+    """
+    if size < (state['width'] * state['height'] + 1) // 2:
+        raise ValueError('Truncated maze file')
+
+
+class MappedMaze:
+    """
+    Read only maze opened from a maze file with mmap. Only the pages that are queried are
+    read from disk, so very large mazes can be inspected without loading them.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            state, self.payloadOffset = decodeHeader(self.map)
+            checkPayload(state, len(self.map) - self.payloadOffset)
+        except ValueError:
+            self.map.close()
+            raise
+        self.width = state['width']
+        self.height = state['height']
+        self.start = state['start']
+        self.entrance = state['entrance']
+        self.finish = state['finish']
+        self.exit = state['exit']
+        self.seed = state['seed']
+        self.algorithm = state['algorithm']
+
+    def wallMask(self, row, col):
+        """
+        :return: Wall mask of a cell, as in Maze.wallBits
+        """
+        index = row * self.width + col
+        return self.map[self.payloadOffset + (index >> 1)] >> ((index & 1) << 2) & 0xf
+
+    def hasWall(self, row, col, direction):
+        return bool(self.wallMask(row, col) >> direction & 1)
+
+    def rowWalls(self, row):
+        """
+        :return: bytearray of the wall masks of one row
+        """
+        first = row * self.width
+        start = self.payloadOffset + (first >> 1)
+        end = self.payloadOffset + ((first + self.width + 1) >> 1)
+        walls = unpackWalls(self.map[start:end], (end - start) * 2)
+        return walls[first & 1:(first & 1) + self.width]
+
+    def toMaze(self):
+        """
+        Load the whole maze into memory
+        """
+        state, offset = decodeHeader(self.map)
+        state['walls'] = self.map[offset:]
+        return Maze.fromState(state)
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+# The step generators yield an (event, index, direction) tuple for each change they make.
+# Plain tuples rather than a namedtuple since there is one per wall removed or cell explored.
+#   CARVE - the wall of cell index in direction was opened
+#   VISIT - cell index was marked visited, direction is how it was entered or -1
+#   TOUCH - a traverser touched the wall of cell index in direction
+#   CLEAR - all visited and traversed marks were removed, index and direction are -1
+#   PATH  - cell index is on the solution found by a solver
+
+CARVE = 'carve'
+VISIT = 'visit'
+TOUCH = 'touch'
+CLEAR = 'clear'
+PATH = 'path'
+
+# Name of the default mark layer, maze.marks
+MARKS = 'marks'
+
+
+def runSteps(steps, callback=None):
+    """
+    Advance a step generator to the end
+
+    :param callback: Called after every step, if given
+    :return: What the generator returned
+    """
+    result = []
+
+    def capture():
+        result.append((yield from steps))
+
+    if callback is None:
+        deque(capture(), maxlen=0)
+    else:
+        for _step in capture():
+            callback()
+    return result[0]
+
+
+class MazeStats:
+    """
+    Counters and per phase timings, collected while a maze has one in its stats attribute
+    (see Maze.collectStats). Nothing is collected, and nothing extra is done per step, without it.
+
+    Counters:
+      steps          - steps yielded by the step generators
+      wallsRemoved   - CARVE steps
+      cellsVisited   - VISIT steps
+      wallTouches    - TOUCH steps
+      pathCells      - PATH steps
+      revisits       - cells the wall toucher entered again
+      stackHighWater - deepest stack of the backtracker
+
+    Timings are the seconds spent inside the generator of each phase: carve, braid, solve and
+    wallToucher, not counting the time taken by whoever consumes the steps.
+    """
+
+    EVENT_COUNTERS = {
+        CARVE: 'wallsRemoved',
+        VISIT: 'cellsVisited',
+        TOUCH: 'wallTouches',
+        PATH: 'pathCells',
+    }
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def peak(self, name, value):
+        """
+        Keep the largest value seen for a counter
+        """
+        if value > self.counters.get(name, 0):
+            self.counters[name] = value
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + time.perf_counter() - started
+
+    def timedSteps(self, phase, steps):
+        """
+        Pass on the steps of a step generator, counting them and timing the generator as the given phase
+
+        :return: Generator returning what steps returns
+        """
+        clock = time.perf_counter
+        counters = self.counters
+        eventCounters = self.EVENT_COUNTERS
+        elapsed = 0.0
+        try:
+            while True:
+                started = clock()
+                try:
+                    step = next(steps)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    elapsed += clock() - started
+
+                counters['steps'] = counters.get('steps', 0) + 1
+                name = eventCounters.get(step[0])
+                if name is not None:
+                    counters[name] = counters.get(name, 0) + 1
+                yield step
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    def asDict(self):
+        return {'counters': dict(self.counters), 'timings': dict(self.timings)}
+
+    def metrics(self, prefix='maze'):
+        """
+        :return: Flat dictionary of metric name to value, e.g. maze.wallsRemoved and maze.carve.seconds
+        """
+        metrics = {f'{prefix}.{name}': value for name, value in self.counters.items()}
+        metrics.update((f'{prefix}.{phase}.seconds', value) for phase, value in self.timings.items())
+        return metrics
+
+    def __repr__(self):
+        return f'MazeStats(counters={self.counters!r}, timings={self.timings!r})'
+
+
+def advanceSteps(steps, count):
+    """
+    Advance a step generator by up to count steps
+
+    :return: List of the steps taken, shorter than count when the generator finished
+    """
+    return list(islice(steps, count))
+
+
+class MarkLayer:
+    """
+    Visited and touched marks of every cell of a maze, cleared by starting a new epoch.
+
+      stamps     - epoch each cell was last visited in, it is visited while that is the current epoch
+      wallStamps - epoch the touched walls of each cell were last marked in
+      walls      - bit n set means the wall in direction n was touched, only if wallStamps is the epoch
+
+    The stamps are a byte per cell, so only once every 255 clears are they really zeroed.
+    """
+
+    MAX_EPOCH = 255
+
+    def __init__(self, size):
+        self.size = size
+        self.epoch = 1
+        self.stamps = bytearray(size)
+        self.wallStamps = bytearray(size)
+        self.walls = bytearray(size)
+
+    def clear(self):
+        if self.epoch == self.MAX_EPOCH:
+            self.stamps[:] = bytes(self.size)
+            self.wallStamps[:] = bytes(self.size)
+            self.epoch = 0
+        self.epoch += 1
+
+    def visit(self, index):
+        self.stamps[index] = self.epoch
+
+    def unvisit(self, index):
+        self.stamps[index] = 0
+
+    def visited(self, index):
+        return self.stamps[index] == self.epoch
+
+    def visitAll(self):
+        self.stamps[:] = bytes([self.epoch]) * self.size
+
+    def touched(self, index):
+        """
+        :return: Mask of the walls of the cell at index that were touched
+        """
+        return self.walls[index] if self.wallStamps[index] == self.epoch else 0
+
+    def setTouched(self, index, mask):
+        self.wallStamps[index] = self.epoch
+        self.walls[index] = mask
+
+    def touch(self, index, direction):
+        self.setTouched(index, self.touched(index) | 1 << direction)
+
+    def visitedBytes(self):
+        """
+        :return: bytes with a 1 for every visited cell
+        """
+        return self.stamps.translate(bytes(value == self.epoch for value in range(256)))
+
+    def touchedBytes(self):
+        """
+        :return: bytes of the touched wall mask of every cell
+        """
+        # 0xff where the masks are current, to combine with them as integers, a byte per cell
+        current = self.wallStamps.translate(bytes(0xff if value == self.epoch else 0 for value in range(256)))
+        masks = int.from_bytes(self.walls, 'little') & int.from_bytes(current, 'little')
+        return masks.to_bytes(self.size, 'little')
+
+
+class LayerBits:
+    """
+    The touched wall masks of a MarkLayer as an indexable array, for CellBits
+    """
+    __slots__ = ('layer',)
+
+    def __init__(self, layer):
+        self.layer = layer
+
+    def __getitem__(self, index):
+        return self.layer.touched(index)
+
+    def __setitem__(self, index, mask):
+        self.layer.setTouched(index, mask)
+
+
+class CellBits:
+    """
+    List like view of the four direction bits of one cell in one of the maze arrays
+    """
+    __slots__ = ('bits', 'index')
+
+    def __init__(self, bits, index):
+        self.bits = bits
+        self.index = index
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, direction):
+        if not 0 <= direction < 4:
+            raise IndexError(direction)
+        return bool(self.bits[self.index] >> direction & 1)
+
+    def __setitem__(self, direction, value):
+        if not 0 <= direction < 4:
+            raise IndexError(direction)
+        if value:
+            self.bits[self.index] |= 1 << direction
+        else:
+            self.bits[self.index] &= ~(1 << direction)
+
+    def __iter__(self):
+        value = self.bits[self.index]
+        return (bool(value >> direction & 1) for direction in range(4))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class Cell:
@@ -14,160 +469,1344 @@ class Cell:
     NORTH = 3
 
     RELATIONSHIP = {EAST: (0, 1), SOUTH: (1, 0), WEST: (0, -1), NORTH: (-1, 0)}
+    OPPOSITE = (WEST, NORTH, EAST, SOUTH)
 
-    def __init__(self, row, col):
-        self.walls = [True] * 4
-        self.wallsTraversed = [False] * 4
-        self.visited = False
+    def __init__(self, maze, row, col):
+        self.maze = maze
         self.row = row
         self.col = col
+        self.index = row * maze.width + col
+
+    @property
+    def walls(self):
+        return CellBits(self.maze.wallBits, self.index)
+
+    @walls.setter
+    def walls(self, values):
+        self.maze.wallBits[self.index] = sum(1 << i for i, w in enumerate(values) if w)
+
+    @property
+    def wallsTraversed(self):
+        return CellBits(LayerBits(self.maze.marks), self.index)
+
+    @wallsTraversed.setter
+    def wallsTraversed(self, values):
+        self.maze.marks.setTouched(self.index, sum(1 << i for i, w in enumerate(values) if w))
+
+    @property
+    def visited(self):
+        return self.maze.marks.visited(self.index)
+
+    @visited.setter
+    def visited(self, value):
+        if value:
+            self.maze.marks.visit(self.index)
+        else:
+            self.maze.marks.unvisit(self.index)
+
+
+class CellRow:
+    """
+    One row of maze.cells
+    """
+
+    def __init__(self, maze, row):
+        self.maze = maze
+        self.row = row
+
+    def __len__(self):
+        return self.maze.width
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [self.maze.getCell(self.row, c) for c in range(self.maze.width)[col]]
+        if col < 0:
+            col += self.maze.width
+        if not 0 <= col < self.maze.width:
+            raise IndexError(col)
+        return self.maze.getCell(self.row, col)
+
+    def __iter__(self):
+        return (self.maze.getCell(self.row, col) for col in range(self.maze.width))
+
+
+class CellGrid:
+    """
+    maze.cells - indexable as cells[row][col] like the old list of lists
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+
+    def __len__(self):
+        return self.maze.height
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [CellRow(self.maze, r) for r in range(self.maze.height)[row]]
+        if row < 0:
+            row += self.maze.height
+        if not 0 <= row < self.maze.height:
+            raise IndexError(row)
+        return CellRow(self.maze, row)
+
+    def __iter__(self):
+        return (CellRow(self.maze, row) for row in range(self.maze.height))
+
+
+class Maze:
+    def __init__(self, width, height, topology='rect', levels=1):
+        """
+        :param topology: Name of one of mazetopology.TOPOLOGIES, or a Topology
+        :param levels: Number of levels of a 'levels' topology. They are stacked as rows, so the
+                       maze height is height * levels.
+        """
+        if isinstance(topology, str):
+            topology = getTopology(topology, width, height, levels)
+        self.topology = topology
+        self.width = topology.width
+        self.height = topology.rows
+        self.cells = CellGrid(self)
         self.exitCell = None
         self.finish = None
         self.exit = None
         self.start = None
         self.entrance = None
+        self.seed = None
+        self.algorithm = None
+        self.changeLog = None
+        self.changeBase = 0
+        self.stats = None
+        self.initialize()
 
+    @classmethod
+    def fromRows(cls, width, rows):
+        """
+        Build a maze from rows of wall masks, as produced by ellerRows. The entrance is taken
+        to be the west of the first cell and the exit the east of the last cell.
+        """
+        walls = bytearray()
+        for row in rows:
+            walls += row
+        maze = cls(width, len(walls) // width)
+        maze.wallBits[:] = walls
+        maze.start = (0, 0)
+        maze.entrance = Cell.WEST
+        maze.finish = (maze.height - 1, width - 1)
+        maze.exit = Cell.EAST
+        maze.exitCell = maze.cells[maze.height - 1][width - 1]
+        return maze
 
-class Maze:
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.cells = []
-        self.initialize()
+    def getState(self):
+        """
+        :return: Compact picklable description of the maze - plain values and the wall
+                 masks packed two cells per byte
+        """
+        topology = self.topology
+        return {
+            'width': self.width,
+            'height': self.height,
+            'topology': topology.name,
+            'levels': topology.levels,
+            'start': self.start,
+            'entrance': self.entrance,
+            'finish': self.finish,
+            'exit': self.exit,
+            'seed': self.seed,
+            'algorithm': self.algorithm,
+            # Masks of more than 4 walls don't fit in a nibble
+            'walls': packWalls(self.wallBits) if topology.directions <= 4 else bytes(self.wallBits),
+        }
+
+    @classmethod
+    def fromState(cls, state):
+        """
+        Rebuild a maze from getState()
+        """
+        levels = state.get('levels', 1)
+        maze = cls(state['width'], state['height'] // levels, state.get('topology', 'rect'), levels)
+        cells = maze.width * maze.height
+        if len(state['walls']) < ((cells + 1) // 2 if maze.topology.directions <= 4 else cells):
+            raise ValueError('Truncated maze walls')
+        if maze.topology.directions <= 4:
+            maze.wallBits[:] = unpackWalls(state['walls'], maze.width * maze.height)
+        else:
+            maze.wallBits[:] = state['walls']
+        maze.start = state['start']
+        maze.entrance = state['entrance']
+        maze.finish = state['finish']
+        maze.exit = state['exit']
+        maze.seed = state['seed']
+        maze.algorithm = state['algorithm']
+        if maze.finish is not None:
+            maze.exitCell = maze.cells[maze.finish[0]][maze.finish[1]]
+        return maze
+
+    def save(self, target):
+        """
+        Write the maze in the binary maze file format
+
+        :param target: File name or a binary file object
+        """
+        if self.topology.name != 'rect':
+            raise ValueError(f'Maze files hold rect mazes, not {self.topology.name}')
+        state = self.getState()
+        if hasattr(target, 'write'):
+            target.write(encodeHeader(state))
+            target.write(state['walls'])
+        else:
+            with open(target, 'wb') as file:
+                self.save(file)
+
+    @classmethod
+    def load(cls, source, mapped=False):
+        """
+        Read a maze saved by save()
+
+        :param source: File name or a binary file object
+        :param mapped: Memory map the file and return a read only MappedMaze instead of loading it
+        """
+        if mapped:
+            return MappedMaze(source)
+        if hasattr(source, 'read'):
+            data = source.read()
+        else:
+            with open(source, 'rb') as file:
+                data = file.read()
+        state, offset = decodeHeader(data)
+        checkPayload(state, len(data) - offset)
+        state['walls'] = data[offset:]
+        return cls.fromState(state)
 
     def initialize(self):
-        self.cells = [[Cell(row, col) for col in range(self.width)] for row in range(self.height)]
+        topology = self.topology
+        if topology.width != self.width or topology.rows != self.height:
+            # Resized by setting width and height
+            self.topology = topology = getTopology(topology.name, self.width, self.height // topology.levels,
+                                                   topology.levels)
+        size = self.width * self.height
+        self.wallBits = bytearray([topology.allWalls]) * size
+        self.layers = {}
+        self.marks = self.layer()
+        self.cellViews = {}
+        if self.changeLog is not None:
+            self.changeBase += len(self.changeLog) + 1
+            self.changeLog = []
+
+    def trackChanges(self):
+        """
+        Start recording which cells have their walls changed by removeWallAt, removeCommonWall,
+        removeWall or the step generators, for views that only want to redraw what changed.
+
+        :return: The current change version, to pass to changedSince
+        """
+        if self.changeLog is None:
+            self.changeLog = []
+        return self.changeVersion()
+
+    def changeVersion(self):
+        return self.changeBase + len(self.changeLog)
+
+    def changedSince(self, version):
+        """
+        :return: (new version, set of indexes of the cells whose walls changed since version).
+                 The set is None if everything has to be treated as changed, because the maze
+                 was initialized or the changes were trimmed since.
+        """
+        log = self.changeLog
+        newVersion = self.changeBase + len(log)
+        if version < self.changeBase:
+            return newVersion, None
+        return newVersion, set(log[version - self.changeBase:newVersion - self.changeBase])
+
+    def trimChanges(self, version):
+        """
+        Forget the changes before version
+        """
+        count = min(version - self.changeBase, len(self.changeLog))
+        if count > 0:
+            del self.changeLog[:count]
+            self.changeBase += count
+
+    def collectStats(self, enabled=True):
+        """
+        Start collecting counters and timings in a fresh MazeStats, or stop
+
+        :return: The MazeStats, also in self.stats, or None when disabled
+        """
+        self.stats = MazeStats() if enabled else None
+        return self.stats
 
-    def removeMarks(self):
-        for row in self.cells:
-            for cell in row:
-                cell.wallsTraversed = [False] * 4
-                cell.visited = False
+    def layer(self, name=MARKS):
+        """
+        :return: The MarkLayer called name, made when first asked for. MARKS is maze.marks.
+        """
+        layer = self.layers.get(name)
+        if layer is None:
+            layer = self.layers[name] = MarkLayer(self.width * self.height)
+        return layer
+
+    @property
+    def visitedBits(self):
+        return bytearray(self.marks.visitedBytes())
+
+    @property
+    def traversedBits(self):
+        return bytearray(self.marks.touchedBytes())
+
+    def removeMarks(self, layer=MARKS):
+        self.layer(layer).clear()
+
+    def getCell(self, row, col):
+        index = row * self.width + col
+        cell = self.cellViews.get(index)
+        if cell is None:
+            cell = self.cellViews[index] = Cell(self, row, col)
+        return cell
+
+    def rowWalls(self, row):
+        """
+        :return: bytearray of the wall masks of one row, as MappedMaze.rowWalls
+        """
+        return self.wallBits[row * self.width:(row + 1) * self.width]
+
+    def neighbourIndex(self, index, direction):
+        """
+        :return: Index of the neighbouring cell in the given direction, or -1 at the edge of the maze
+        """
+        topology = self.topology
+        offset = topology.steps[topology.cellClass[index]][direction]
+        return -1 if offset is None else index + offset
 
     def getNeighbours(self, currentCell):
-        neighbours = []
-        if currentCell.col > 0:
-            neighbours.append(self.cells[currentCell.row][currentCell.col - 1])
-        if currentCell.col < self.width - 1:
-            neighbours.append(self.cells[currentCell.row][currentCell.col + 1])
-        if currentCell.row > 0:
-            neighbours.append(self.cells[currentCell.row - 1][currentCell.col])
-        if currentCell.row < self.height - 1:
-            neighbours.append(self.cells[currentCell.row + 1][currentCell.col])
-        return neighbours
+        index = currentCell.index
+        topology = self.topology
+        return [self.getCell(*divmod(index + offset, self.width))
+                for _direction, offset in topology.links[topology.cellClass[index]]]
 
     def getNonEdgeCells(self):
         return [row[1:-1] for row in self.cells[1:-1]]
 
     def getNeighbour(self, cell, relationship):
-        rowInc, colInc = Cell.RELATIONSHIP[relationship]
-        return self.cells[cell.row + rowInc][cell.col + colInc]
+        neighbour = self.neighbourIndex(cell.index, relationship)
+        if neighbour < 0:
+            raise IndexError(relationship)
+        return self.getCell(*divmod(neighbour, self.width))
+
+    def removeWallAt(self, index, direction):
+        """
+        Open the wall of the cell at index in the given direction, and the matching wall
+        of the neighbour on the other side, if there is one
+        """
+        walls = self.wallBits
+        walls[index] &= ~(1 << direction)
+        neighbour = self.neighbourIndex(index, direction)
+        if neighbour >= 0:
+            walls[neighbour] &= ~(1 << self.topology.opposite[direction])
+        if self.changeLog is not None:
+            self.changeLog.append(index)
+            if neighbour >= 0:
+                self.changeLog.append(neighbour)
 
     def removeCommonWall(self, cellA, cellB):
-        if cellA.col == cellB.col:
-            if cellA.row < cellB.row:
-                cellA.walls[Cell.SOUTH] = False
-                cellB.walls[Cell.NORTH] = False
-            else:
-                cellA.walls[Cell.NORTH] = False
-                cellB.walls[Cell.SOUTH] = False
-        else:
-            if cellA.col < cellB.col:
-                cellA.walls[Cell.EAST] = False
-                cellB.walls[Cell.WEST] = False
-            else:
-                cellA.walls[Cell.WEST] = False
-                cellB.walls[Cell.EAST] = False
+        for direction, neighbour in self.topology.neighbours(cellA.index):
+            if neighbour == cellB.index:
+                self.removeWallAt(cellA.index, direction)
+                return
+        raise ValueError('The cells are not neighbours')
 
     def removeWall(self, cell, wall):
         self.removeCommonWall(cell, self.getNeighbour(cell, wall))
 
-    def randomizeBacktracker(self, start=(0, 0), entrance=Cell.WEST, finish=None, exit_direction=Cell.EAST, callback=None,
-                             loops=0, finished=None):
-        stack = []
-        currentCell = self.cells[start[0]][start[1]]
-        currentCell.walls[entrance] = False
-        currentCell.visited = True
-        stack.append(currentCell)
+    def generateSteps(self, algorithm='backtracker', start=(0, 0), entrance=None, finish=None,
+                      exit_direction=None, loops=0, seed=None, deadEndsFirst=False, layer=MARKS):
+        """
+        Carve a maze with one of the algorithms in GENERATORS, selected by name.
+        If seed is given the maze is drawn from its own random.Random(seed) rather than the
+        global random state, so the same seed always gives the same maze.
+        loops and deadEndsFirst are as for braidSteps. The cells are marked visited as they are
+        connected, in the mark layer called layer. entrance and exit_direction default to the
+        topology's entrance and exit, west and east.
+
+        :return: Generator that carves the maze as it is advanced, yielding a step per change
+        """
+        carve = GENERATORS[algorithm]
+        rng = random if seed is None else random.Random(seed)
+        self.seed = seed
+        self.algorithm = algorithm
+
+        yield from self.openEntrances(start, entrance, finish, exit_direction)
+
+        # The carvers go by the visited marks, so they start from a fresh epoch
+        marks = self.layer(layer)
+        marks.clear()
+        steps = carve(self, start[0] * self.width + start[1], rng, marks)
+        if self.stats is not None:
+            steps = self.stats.timedSteps('carve', steps)
+
+        if self.changeLog is None:
+            yield from steps
+        else:
+            # The carvers write wallBits directly, so record their changes from the steps
+            changeLog = self.changeLog
+            neighbourIndex = self.neighbourIndex
+            for step in steps:
+                changeLog.append(step[1])
+                changeLog.append(neighbourIndex(step[1], step[2]))
+                yield step
+
+        if loops:
+            steps = self.braidSteps(loops, rng, deadEndsFirst)
+            if self.stats is not None:
+                steps = self.stats.timedSteps('braid', steps)
+            yield from steps
+
+    def generate(self, algorithm='backtracker', start=(0, 0), entrance=None, finish=None,
+                 exit_direction=None, callback=None, loops=0, finished=None, seed=None, deadEndsFirst=False,
+                 layer=MARKS):
+        """
+        Run generateSteps to the end, calling callback after each step and finished at the end
+        """
+        runSteps(self.generateSteps(algorithm, start, entrance, finish, exit_direction, loops, seed, deadEndsFirst,
+                                    layer),
+                 callback)
 
+        if finished is not None:
+            finished()
+
+    def openEntrances(self, start=(0, 0), entrance=None, finish=None, exit_direction=None):
+        """
+        Open the entrance and exit walls, by default the topology's entrance and exit, and record
+        where they are
+
+        :return: List of a CARVE step for each wall opened
+        """
+        if entrance is None:
+            entrance = self.topology.entrance
+        if exit_direction is None:
+            exit_direction = self.topology.exit
+        opened = []
+        startIndex = start[0] * self.width + start[1]
         if finish is None:
             finish = (self.height - 1, self.width - 1)
-
         self.exitCell = self.cells[finish[0]][finish[1]]
-        self.exitCell.walls[exit_direction] = False
+
+        for index, direction in ((startIndex, entrance), (self.exitCell.index, exit_direction)):
+            # Where the grid wraps round there's no outside to open onto
+            if self.neighbourIndex(index, direction) < 0:
+                self.wallBits[index] &= ~(1 << direction)
+                opened.append((CARVE, index, direction))
+                if self.changeLog is not None:
+                    self.changeLog.append(index)
 
         self.finish = finish
         self.exit = exit_direction
         self.start = start
         self.entrance = entrance
+        return opened
 
-        while len(stack):
-            currentCell = stack.pop()
-            neighbours = self.getNeighbours(currentCell)
-            neighbours = [n for n in neighbours if not n.visited]
+    def randomizeBacktracker(self, start=(0, 0), entrance=None, finish=None, exit_direction=None, callback=None,
+                             loops=0, finished=None):
+        self.generate('backtracker', start, entrance, finish, exit_direction, callback, loops, finished)
 
-            if len(neighbours) > 0:
-                stack.append(currentCell)
-                selectedNeighbour = random.choice(neighbours)
-                selectedNeighbour.visited = True
+    def interiorWallsStanding(self):
+        """
+        :return: Number of walls between two cells of the maze that are standing
+        """
+        return sum(self.standingWalls(direction).count(1) for direction in self.topology.forward)
 
-                self.removeCommonWall(currentCell, selectedNeighbour)
+    def standingWalls(self, direction):
+        """
+        :return: bytes with a 1 for every cell whose wall in direction is standing and has a cell on the other side
+        """
+        # Both are bytes of 0 and 1, so they are combined as integers without carries
+        ink = int.from_bytes(self.wallBits.translate(WALL_INK[direction]), 'little')
+        linked = int.from_bytes(self.topology.linked(direction), 'little')
+        return (ink & linked).to_bytes(len(self.wallBits), 'little')
 
-                stack.append(selectedNeighbour)
+    def braidSteps(self, loops, rng=random, deadEndsFirst=False):
+        """
+        Add loops by removing walls between cells. The outer boundary is never opened.
 
-                if callback is not None:
-                    callback()
+        Walls are picked by drawing random cell indexes and trying their east or south wall, so
+        only the walls removed are ever listed, unless more than half of the walls left are wanted.
 
-        if loops:
-            nonEdge = self.getNonEdgeCells()
-            targets = [cell for row in nonEdge for cell in row]
-            targets = random.sample(targets, loops)
-            for cell in targets:
-                walls = [i for i, w in enumerate(cell.walls) if w]
-                if len(walls):
-                    wallToRemove = random.choice(walls)
-                    print(f'Removing wall {wallToRemove} in cell {cell.row}, {cell.col}')
+        :param loops: Number of walls to remove, or a float for that fraction of the number of cells.
+                      There are fewer only if the maze runs out of interior walls.
+        :param deadEndsFirst: Open dead ends first, in random order, preferring walls that join two
+                              dead ends, before removing any other walls
+        :return: Generator yielding a CARVE step per wall removed
+        """
+        width = self.width
+        walls = self.wallBits
+        neighbourIndex = self.neighbourIndex
+        topology = self.topology
+        deadEndMasks = topology.deadEnds
+        forward = topology.forward
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        if isinstance(loops, float):
+            loops = round(loops * width * self.height)
+        standing = self.interiorWallsStanding()
+        if loops > standing:
+            log.warning('Only %d of %d loops can be added', standing, loops)
+            loops = standing
+        remaining = loops
+
+        if deadEndsFirst and remaining:
+            deadEnds = [match.start() for match in re.finditer(b'\x01', walls.translate(deadEndMasks))]
+            rng.shuffle(deadEnds)
+            for index in deadEnds:
+                if remaining == 0:
+                    break
+                # Joining two dead ends earlier can have opened this one already
+                if not deadEndMasks[walls[index]]:
+                    continue
+                closed = [direction for direction in range(topology.directions)
+                          if walls[index] >> direction & 1 and neighbourIndex(index, direction) >= 0]
+                if not closed:
+                    continue
+                joining = [direction for direction in closed if deadEndMasks[walls[neighbourIndex(index, direction)]]]
+                direction = rng.choice(joining or closed)
+                self.removeWallAt(index, direction)
+                remaining -= 1
+                if debug:
+                    log.debug('Removing wall %d in dead end %d, %d', direction, *divmod(index, width))
+                yield CARVE, index, direction
+
+        if remaining * 2 > standing - (loops - remaining):
+            # Most of what is left is wanted, so list the walls rather than miss again and again
+            candidates = []
+            for direction in forward:
+                candidates += [(match.start(), direction)
+                               for match in re.finditer(b'\x01', self.standingWalls(direction))]
+            chosen = rng.sample(candidates, remaining)
+        else:
+            cells = len(walls)
+            if len(forward) == 2:
+                chosen = iter(lambda: (rng.randrange(cells), forward[rng.getrandbits(1)]), None)
+            else:
+                chosen = iter(lambda: (rng.randrange(cells), rng.choice(forward)), None)
+
+        for index, direction in chosen:
+            if remaining == 0:
+                break
+            if not walls[index] >> direction & 1 or neighbourIndex(index, direction) < 0:
+                continue
+            self.removeWallAt(index, direction)
+            remaining -= 1
+            if debug:
+                log.debug('Removing wall %d in cell %d, %d', direction, *divmod(index, width))
+            yield CARVE, index, direction
+
+    def addLoopSteps(self, loops, rng=random, deadEndsFirst=False):
+        """
+        Same as braidSteps
+        """
+        return self.braidSteps(loops, rng, deadEndsFirst)
+
+    def addLoops(self, loops, callback=None, rng=random, deadEndsFirst=False):
+        runSteps(self.braidSteps(loops, rng, deadEndsFirst), callback)
+
+    def openNeighbours(self, index):
+        """
+        :return: Indexes of the cells reachable from the cell at index in one step
+        """
+        topology = self.topology
+        mask = self.wallBits[index]
+        return [index + offset for direction, offset in topology.links[topology.cellClass[index]]
+                if not mask >> direction & 1]
 
-                    self.removeWall(cell, wallToRemove)
+    def distanceField(self, source=None, callback=None, layer=MARKS):
+        """
+        Breadth first search over the whole maze
 
-                    if callback is not None:
-                        callback()
+        :param source: (row, col) to measure from, the start by default
+        :param layer: Name of the mark layer the cells reached are marked visited in
+        :return: array of the distance of every cell from source, -1 where it can't be reached
+        """
+        if source is None:
+            source = self.start
+        distances, _parents = runSteps(breadthFirst(self, source[0] * self.width + source[1], -1, self.layer(layer)),
+                                       callback)
+        return distances
+
+    def solveSteps(self, algorithm='astar', layer=MARKS):
+        """
+        Find the shortest path from start to finish with one of the algorithms in SOLVERS.
+
+        While searching, the cells explored are marked visited in the mark layer called layer.
+        When done, only the cells on the path are left marked. Solving in a layer of its own
+        leaves the marks shown by a front end alone.
+
+        :return: Generator yielding a step per change, and returning an array of the cell
+                 indexes on the path, start first, empty if there is none
+        """
+        marks = self.layer(layer)
+        marks.clear()
+        yield CLEAR, -1, -1
+
+        steps = SOLVERS[algorithm](self, self.start[0] * self.width + self.start[1], self.exitCell.index, marks)
+        if self.stats is not None:
+            steps = self.stats.timedSteps('solve', steps)
+        path = yield from steps
+
+        marks.clear()
+        yield CLEAR, -1, -1
+        for index in path:
+            marks.visit(index)
+            yield PATH, index, -1
+        return path
+
+    def solve(self, algorithm='astar', callback=None, finished=None, layer=MARKS):
+        """
+        Run solveSteps to the end, calling callback after each step and finished at the end
+
+        :return: The path
+        """
+        path = runSteps(self.solveSteps(algorithm, layer), callback)
 
         if finished is not None:
             finished()
+        return path
+
+    def wallToucherSteps(self, rightHand=True, layer=MARKS):
+        """
+        Follow the right (or left) hand wall from the entrance to the exit, marking the cells
+        entered and walls touched in the mark layer called layer
+
+        :return: Generator yielding a step per cell entered or wall touched
+        """
+        steps = self.followWallSteps(rightHand, self.layer(layer))
+        if self.stats is not None:
+            steps = self.stats.timedSteps('wallToucher', steps)
+        return steps
+
+    def followWallSteps(self, rightHand, marks):
+        marks.clear()
+        yield CLEAR, -1, -1
+        walls = self.wallBits
+        visited = marks.stamps
+        epoch = marks.epoch
+        stats = self.stats
+        debug = log.isEnabledFor(logging.DEBUG)
 
-    def wallToucher(self, rightHand=True, callback=None, finished=None):
-        self.removeMarks()
-        startCell = currentCell = self.cells[self.start[0]][self.start[1]]
-        currentDirection = (self.entrance + 2) % 4
-        currentCell.visited = True
+        turns = self.topology.turns
+        if turns != self.topology.directions:
+            raise ValueError(f'Wall following needs a flat maze, not {self.topology.name}')
 
-        print(f'exit {self.exitCell.row} {self.exitCell.col}')
+        startIndex = current = self.start[0] * self.width + self.start[1]
+        exitIndex = self.exitCell.index
+        currentDirection = self.topology.opposite[self.entrance]
+        visited[current] = epoch
+        yield VISIT, current, -1
 
-        cellOrder = range(1, -3, -1) if rightHand else range(-1, 3, 1)
+        if debug:
+            log.debug('Exit %d %d', self.exitCell.row, self.exitCell.col)
 
-        while currentCell.row != self.exitCell.row or currentCell.col != self.exitCell.col:
-            print(f'Cell {currentCell.row} {currentCell.col}')
+        # Rightmost or leftmost turn first, turning back last
+        sharpest = (turns - 1) // 2
+        cellOrder = range(sharpest, sharpest - turns, -1) if rightHand else range(-sharpest, turns - sharpest)
+
+        while current != exitIndex:
             for direction in cellOrder:
-                tryDirection = (currentDirection + direction) % 4
-                print(f'Curernt {currentDirection} Try {tryDirection} wall {currentCell.walls[tryDirection]}')
+                tryDirection = (currentDirection + direction) % turns
+                wall = walls[current] >> tryDirection & 1
 
-                if currentCell == startCell and tryDirection == self.entrance:
+                if current == startIndex and tryDirection == self.entrance:
                     continue
 
-                if not currentCell.walls[tryDirection]:
-                    currentCell = self.getNeighbour(currentCell, tryDirection)
+                if not wall:
+                    current = self.neighbourIndex(current, tryDirection)
                     currentDirection = tryDirection
-                    print(f'Selected {currentCell.row} {currentCell.col} direction {currentDirection}')
-                    if currentCell.visited:
-                        print("Already been here")
-                    currentCell.visited = True
-                    if callback is not None:
-                        callback()
+                    if debug:
+                        log.debug('Cell %d %d direction %d', current // self.width, current % self.width, currentDirection)
+                    if visited[current] == epoch:
+                        if debug:
+                            log.debug('Already been here')
+                        if stats is not None:
+                            stats.count('revisits')
+                    visited[current] = epoch
+                    yield VISIT, current, currentDirection
                     break
                 else:
-                    currentCell.wallsTraversed[tryDirection] = True
+                    marks.touch(current, tryDirection)
+                    yield TOUCH, current, tryDirection
+
+        if debug:
+            log.debug('Finished')
+
+    def wallToucher(self, rightHand=True, callback=None, finished=None, layer=MARKS):
+        runSteps(self.wallToucherSteps(rightHand, layer), callback)
 
-        print("Finished")
         if finished is not None:
             finished()
+
+    def replay(self, steps, layer=MARKS):
+        """
+        Apply a recorded sequence of steps, from any of the step generators, to this maze,
+        marking the mark layer called layer
+        """
+        marks = self.layer(layer)
+        for event, index, direction in steps:
+            if event == CARVE:
+                self.removeWallAt(index, direction)
+                marks.visit(index)
+                neighbour = self.neighbourIndex(index, direction)
+                if neighbour >= 0:
+                    marks.visit(neighbour)
+            elif event == VISIT or event == PATH:
+                marks.visit(index)
+            elif event == TOUCH:
+                marks.touch(index, direction)
+            elif event == CLEAR:
+                marks.clear()
+
+
+# ------------------------------------------------------------------------------------------
+# Generation algorithms. Each one is called as carve(maze, startIndex, rng, marks) on a maze
+# whose walls are all standing, and returns a generator that opens walls until every cell is
+# connected to the start by exactly one path. It marks the cells it connects as visited in the
+# MarkLayer marks, which has no cell visited to begin with, and yields a CARVE step after each
+# wall removal.
+# ------------------------------------------------------------------------------------------
+
+def carveBacktracker(maze, startIndex, rng, marks):
+    """
+    Recursive backtracker - depth first search with an explicit stack
+    """
+    walls = maze.wallBits
+    visited = marks.stamps
+    epoch = marks.epoch
+    links = maze.topology.links
+    cellClass = maze.topology.cellClass
+    opposite = maze.topology.opposite
+
+    visited[startIndex] = epoch
+    stack = [startIndex]
+
+    highWater = 1
+
+    while len(stack):
+        current = stack[-1]
+
+        # Same order as getNeighbours
+        neighbours = [link for link in links[cellClass[current]] if visited[current + link[1]] != epoch]
+
+        if len(neighbours) > 0:
+            direction, offset = rng.choice(neighbours)
+            selected = current + offset
+            visited[selected] = epoch
+
+            walls[current] &= ~(1 << direction)
+            walls[selected] &= ~(1 << opposite[direction])
+
+            stack.append(selected)
+
+            yield CARVE, current, direction
+        else:
+            # The stack is at its deepest just before a pop
+            if len(stack) > highWater:
+                highWater = len(stack)
+            stack.pop()
+
+    if maze.stats is not None:
+        maze.stats.peak('stackHighWater', highWater)
+
+
+def carveKruskal(maze, startIndex, rng, marks):
+    """
+    Randomized Kruskal - open the internal walls in random order whenever they separate
+    two different trees, tracked with a union-find using path halving and union by size
+    """
+    topology = maze.topology
+    walls = maze.wallBits
+    visited = marks.stamps
+    epoch = marks.epoch
+    size = maze.width * maze.height
+    steps = topology.steps
+    cellClass = topology.cellClass
+    forward = topology.forward
+    opposite = topology.opposite
+    count = len(forward)
+
+    parent = list(range(size))
+    treeSize = [1] * size
+
+    # Edge e is the wall of cell e // count in direction forward[e % count], for a rect maze the
+    # east wall of cell e // 2 if e is even, otherwise its south wall
+    edges = []
+    for slot, direction in enumerate(forward):
+        edges += [index * count + slot for index in compress(range(size), topology.linked(direction))]
+    rng.shuffle(edges)
+
+    visited[startIndex] = epoch
+    remaining = size - 1
+    for edge in edges:
+        if not remaining:
+            break
+        index, slot = divmod(edge, count)
+        direction = forward[slot]
+        other = index + steps[cellClass[index]][direction]
+
+        rootA = index
+        while parent[rootA] != rootA:
+            parent[rootA] = parent[parent[rootA]]
+            rootA = parent[rootA]
+        rootB = other
+        while parent[rootB] != rootB:
+            parent[rootB] = parent[parent[rootB]]
+            rootB = parent[rootB]
+        if rootA == rootB:
+            continue
+
+        if treeSize[rootA] < treeSize[rootB]:
+            rootA, rootB = rootB, rootA
+        parent[rootB] = rootA
+        treeSize[rootA] += treeSize[rootB]
+        remaining -= 1
+
+        walls[index] &= ~(1 << direction)
+        walls[other] &= ~(1 << opposite[direction])
+        visited[index] = epoch
+        visited[other] = epoch
+
+        yield CARVE, index, direction
+
+
+def carveWilson(maze, startIndex, rng, marks):
+    """
+    Wilson's algorithm - loop erased random walks from each cell not yet in the tree,
+    giving a uniformly chosen spanning tree
+    """
+    topology = maze.topology
+    walls = maze.wallBits
+    visited = marks.stamps
+    epoch = marks.epoch
+    size = maze.width * maze.height
+    steps = topology.steps
+    cellClass = topology.cellClass
+    opposite = topology.opposite
+    directions = topology.directions
+
+    # Direction the walk last left each cell by, overwriting it erases any loop
+    leftBy = bytearray(size)
+    visited[startIndex] = epoch
+
+    for first in range(size):
+        if visited[first] == epoch:
+            continue
+
+        current = first
+        while visited[current] != epoch:
+            offsets = steps[cellClass[current]]
+            while True:
+                direction = rng.randrange(directions)
+                if offsets[direction] is not None:
+                    break
+            leftBy[current] = direction
+            current += offsets[direction]
+
+        current = first
+        while visited[current] != epoch:
+            direction = leftBy[current]
+            selected = current + steps[cellClass[current]][direction]
+            visited[current] = epoch
+            walls[current] &= ~(1 << direction)
+            walls[selected] &= ~(1 << opposite[direction])
+            yield CARVE, current, direction
+            current = selected
+
+
+def carvePrim(maze, startIndex, rng, marks):
+    """
+    Randomized Prim - grow the tree from a random frontier cell each step. The frontier
+    is a list with each cell's position kept in an index so it can be removed in O(1)
+    """
+    walls = maze.wallBits
+    visited = marks.stamps
+    epoch = marks.epoch
+    links = maze.topology.links
+    cellClass = maze.topology.cellClass
+    opposite = maze.topology.opposite
+
+    frontier = []
+    position = {}
+
+    def addCell(index):
+        visited[index] = epoch
+        for _direction, offset in links[cellClass[index]]:
+            neighbour = index + offset
+            if visited[neighbour] != epoch and neighbour not in position:
+                position[neighbour] = len(frontier)
+                frontier.append(neighbour)
+
+    addCell(startIndex)
+
+    while frontier:
+        pick = rng.randrange(len(frontier))
+        current = frontier[pick]
+        last = frontier.pop()
+        if last != current:
+            frontier[pick] = last
+            position[last] = pick
+        del position[current]
+
+        inTree = [link for link in links[cellClass[current]] if visited[current + link[1]] == epoch]
+
+        direction, offset = rng.choice(inTree)
+        walls[current] &= ~(1 << direction)
+        walls[current + offset] &= ~(1 << opposite[direction])
+        addCell(current)
+
+        yield CARVE, current, direction
+
+
+GENERATORS = {
+    'backtracker': carveBacktracker,
+    'kruskal': carveKruskal,
+    'wilson': carveWilson,
+    'prim': carvePrim,
+}
+
+
+# ------------------------------------------------------------------------------------------
+# Shortest path solvers. Each one is called as solve(maze, startIndex, finishIndex, marks) and
+# returns a generator that marks the cells it explores as visited in the MarkLayer marks, which
+# has no cell visited to begin with, yielding a VISIT step for each. The generator returns the
+# path as an array of cell indexes, empty if finish can't be reached.
+# ------------------------------------------------------------------------------------------
+
+def tracePath(parents, index):
+    """
+    Follow parents back from index to the cell that is its own parent
+
+    :return: array of indexes from that cell to index
+    """
+    path = array('i', [index])
+    while parents[index] != index:
+        index = parents[index]
+        path.append(index)
+    path.reverse()
+    return path
+
+
+def breadthFirst(maze, startIndex, finishIndex, marks):
+    """
+    :return: Generator returning (distances, parents) arrays, filled until finishIndex is reached
+    """
+    size = maze.width * maze.height
+    visited = marks.stamps
+    epoch = marks.epoch
+    distances = array('i', [-1]) * size
+    parents = array('i', [-1]) * size
+    openNeighbours = maze.openNeighbours
+
+    distances[startIndex] = 0
+    parents[startIndex] = startIndex
+    queue = [startIndex]
+    for current in queue:
+        visited[current] = epoch
+        yield VISIT, current, -1
+        if current == finishIndex:
+            break
+        distance = distances[current] + 1
+        for neighbour in openNeighbours(current):
+            if distances[neighbour] < 0:
+                distances[neighbour] = distance
+                parents[neighbour] = current
+                queue.append(neighbour)
+    return distances, parents
+
+
+def solveBreadthFirst(maze, startIndex, finishIndex, marks):
+    distances, parents = yield from breadthFirst(maze, startIndex, finishIndex, marks)
+    if distances[finishIndex] < 0:
+        return array('i')
+    return tracePath(parents, finishIndex)
+
+
+def solveBidirectional(maze, startIndex, finishIndex, marks):
+    """
+    Breadth first search from both ends a level at a time, stopping where they meet
+    """
+    size = maze.width * maze.height
+    visited = marks.stamps
+    epoch = marks.epoch
+    openNeighbours = maze.openNeighbours
+    # Which search reached each cell first: 1 from start, 2 from finish
+    side = bytearray(size)
+    parents = array('i', [-1]) * size
+
+    side[startIndex] = 1
+    side[finishIndex] = 2
+    parents[startIndex] = startIndex
+    parents[finishIndex] = finishIndex
+    frontiers = {1: [startIndex], 2: [finishIndex]}
+    meeting = (startIndex, startIndex) if startIndex == finishIndex else None
+
+    while meeting is None and frontiers[1] and frontiers[2]:
+        current = 1 if len(frontiers[1]) <= len(frontiers[2]) else 2
+        nextFrontier = []
+        for index in frontiers[current]:
+            visited[index] = epoch
+            yield VISIT, index, -1
+            for neighbour in openNeighbours(index):
+                if not side[neighbour]:
+                    side[neighbour] = current
+                    parents[neighbour] = index
+                    nextFrontier.append(neighbour)
+                elif side[neighbour] != current:
+                    meeting = (index, neighbour) if current == 1 else (neighbour, index)
+                    break
+            if meeting is not None:
+                break
+        frontiers[current] = nextFrontier
+
+    if meeting is None:
+        return array('i')
+
+    fromStart, fromFinish = meeting
+    path = tracePath(parents, fromStart)
+    if fromFinish != fromStart:
+        toFinish = tracePath(parents, fromFinish)
+        toFinish.reverse()
+        path.extend(toFinish)
+    return path
+
+
+def solveAStar(maze, startIndex, finishIndex, marks):
+    """
+    A* with the distance to finish on an empty grid as heuristic, the Manhattan distance on a rect grid
+    """
+    size = maze.width * maze.height
+    visited = marks.stamps
+    epoch = marks.epoch
+    openNeighbours = maze.openNeighbours
+    distance = maze.topology.distanceTo(finishIndex)
+    costs = array('i', [-1]) * size
+    parents = array('i', [-1]) * size
+
+    costs[startIndex] = 0
+    parents[startIndex] = startIndex
+    heap = [(0, 0, startIndex)]
+    while heap:
+        _estimate, cost, current = heapq.heappop(heap)
+        if cost > costs[current] or visited[current] == epoch:
+            continue
+        visited[current] = epoch
+        yield VISIT, current, -1
+        if current == finishIndex:
+            return tracePath(parents, finishIndex)
+
+        cost += 1
+        for neighbour in openNeighbours(current):
+            if costs[neighbour] < 0 or cost < costs[neighbour]:
+                costs[neighbour] = cost
+                parents[neighbour] = current
+                heapq.heappush(heap, (cost + distance(neighbour), cost, neighbour))
+    return array('i')
+
+
+SOLVERS = {
+    'bfs': solveBreadthFirst,
+    'bidirectional': solveBidirectional,
+    'astar': solveAStar,
+}
+
+
+def ellerRows(width, height=None, rng=random):
+    """
+    Generate a maze row by row with Eller's algorithm.
+
+    Only the current row is kept, so memory is proportional to the width and height may be
+    None for an endless maze. The entrance is the west wall of the first cell, and if height
+    is given the exit is the east wall of the last cell.
+
+    :return: generator of bytes objects, one wall mask per cell as in Maze.wallBits
+    """
+    if width < 1:
+        raise ValueError("width must be at least 1")
+
+    openNorth = [False] * width
+    sets = [0] * width
+    members = {}
+    nextSet = 1
+    row = 0
+
+    while height is None or row < height:
+        lastRow = height is not None and row == height - 1
+        masks = bytearray([ALL_WALLS]) * width
+
+        if row == 0:
+            masks[0] &= ~(1 << Cell.WEST)
+
+        for col in range(width):
+            if openNorth[col]:
+                masks[col] &= ~(1 << Cell.NORTH)
+            else:
+                sets[col] = nextSet
+                members[nextSet] = [col]
+                nextSet += 1
+
+        # Join neighbours in different sets, always on the last row so everything connects
+        for col in range(width - 1):
+            setA, setB = sets[col], sets[col + 1]
+            if setA != setB and (lastRow or rng.random() < 0.5):
+                masks[col] &= ~(1 << Cell.EAST)
+                masks[col + 1] &= ~(1 << Cell.WEST)
+                if len(members[setA]) < len(members[setB]):
+                    setA, setB = setB, setA
+                for member in members[setB]:
+                    sets[member] = setA
+                members[setA].extend(members.pop(setB))
+
+        if lastRow:
+            masks[width - 1] &= ~(1 << Cell.EAST)
+        else:
+            # Every set carries on south at least once
+            for setId, cols in list(members.items()):
+                down = [col for col in cols if rng.random() < 0.5]
+                if not down:
+                    down = [rng.choice(cols)]
+                for col in cols:
+                    openNorth[col] = False
+                for col in down:
+                    masks[col] &= ~(1 << Cell.SOUTH)
+                    openNorth[col] = True
+                if len(down) < len(cols):
+                    members[setId] = down
+
+        yield bytes(masks)
+        row += 1
+
+
+def writeEllerRows(stream, width, height=None, rng=random):
+    """
+    Stream an Eller's algorithm maze to a file or socket, one row of wall masks at a time.
+
+    :param stream: Anything with write() (files, pipes) or sendall() (sockets)
+    :return: Number of rows written
+    """
+    write = stream.sendall if hasattr(stream, 'sendall') else stream.write
+    rows = 0
+    for row in ellerRows(width, height, rng):
+        write(row)
+        rows += 1
+    return rows
+
+
+# Rendering. Walls are drawn on the lines between cells, wallSize pixels thick, so an image is
+# width * cellSize + wallSize pixels wide. Pixel rows are built with bytes.translate and extended
+# slice assignment, a whole row of cells per operation, and written out as they are made.
+
+INK_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+PAPER_DIGITS = bytes.maketrans(b'\x00\x01', b'10')
+PNG_CHUNK_SIZE = 1 << 16
+
+
+def wallLines(maze):
+    """
+    Walk the grid lines of a maze from top to bottom. Line row is the north edge of cell row row,
+    the last line is the south edge of the maze.
+
+    :param maze: Maze or MappedMaze
+    :return: generator of (row, horizontal, vertical). horizontal has a 1 for every cell whose wall
+             on the line is standing, vertical a 1 for each of the width + 1 vertical walls of the
+             row below the line (all 0 after the last row).
+    """
+    topology = getattr(maze, 'topology', None)
+    if topology is not None and topology.turns != 4:
+        raise ValueError(f'Only square cells can be drawn, not {topology.name}')
+    width = maze.width
+    walls = None
+    for row in range(maze.height):
+        walls = maze.rowWalls(row)
+        horizontal = walls.translate(WALL_INK[Cell.NORTH])
+        vertical = walls.translate(WALL_INK[Cell.WEST]) + walls[-1:].translate(WALL_INK[Cell.EAST])
+        yield row, horizontal, vertical
+    if walls is not None:
+        yield maze.height, walls.translate(WALL_INK[Cell.SOUTH]), bytes(width + 1)
+
+
+def rasterRows(maze, cellSize=8, wallSize=2):
+    """
+    Rasterize a maze row by row.
+
+    :return: generator of bytes pixel rows, 1 for wall and 0 for floor. Identical consecutive rows
+             are the same object, so writers can reuse their encoding.
+    """
+    if not 0 < wallSize < cellSize:
+        raise ValueError("wallSize must be at least 1 and less than cellSize")
+
+    width = maze.width
+    span = width * cellSize
+    imageWidth = span + wallSize
+    previous = 0
+
+    for row, horizontal, vertical in wallLines(maze):
+        # A corner post is inked when any of the four walls meeting at it is standing. Each cell is
+        # one byte of 0 or 1, so whole rows are combined as integers without carries.
+        ink = int.from_bytes(horizontal, 'little')
+        below = int.from_bytes(vertical, 'little')
+        corners = (ink | ink << 8 | below | previous).to_bytes(width + 1, 'little')
+        previous = below
+
+        line = bytearray(imageWidth)
+        for offset in range(wallSize):
+            line[offset::cellSize] = corners
+        for offset in range(wallSize, cellSize):
+            line[offset:span:cellSize] = horizontal
+        line = bytes(line)
+        for _ in range(wallSize):
+            yield line
+
+        if row < maze.height:
+            inside = bytearray(imageWidth)
+            for offset in range(wallSize):
+                inside[offset::cellSize] = vertical
+            inside = bytes(inside)
+            for _ in range(cellSize - wallSize):
+                yield inside
+
+
+def imageSize(maze, cellSize=8, wallSize=2):
+    """
+    :return: (width, height) in pixels of the images made by rasterRows
+    """
+    return maze.width * cellSize + wallSize, maze.height * cellSize + wallSize
+
+
+def packPixels(pixels, digits):
+    """
+    Pack a row of 0 and 1 pixels eight to a byte, first pixel in the most significant bit
+
+    :param digits: INK_DIGITS to keep 1 for wall, or PAPER_DIGITS to swap them
+    """
+    text = pixels.translate(digits) + b'0' * (-len(pixels) % 8)
+    return int(text, 2).to_bytes(len(text) // 8, 'big')
+
+
+def packedRows(maze, cellSize, wallSize, digits):
+    """
+    :return: generator of rasterRows packed by packPixels, encoding each distinct row once
+    """
+    last = packed = None
+    for pixels in rasterRows(maze, cellSize, wallSize):
+        if pixels is not last:
+            last = pixels
+            packed = packPixels(pixels, digits)
+        yield packed
+
+
+def writePbm(maze, stream, cellSize=8, wallSize=2):
+    """
+    Write a maze as a binary (P4) PBM image, black walls on white
+
+    :param stream: Binary file or anything with write()
+    """
+    stream.write(b'P4\n%d %d\n' % imageSize(maze, cellSize, wallSize))
+    for packed in packedRows(maze, cellSize, wallSize, INK_DIGITS):
+        stream.write(packed)
+
+
+def writePng(maze, stream, cellSize=8, wallSize=2, level=6):
+    """
+    Write a maze as a 1 bit greyscale PNG image, black walls on white. The image data is
+    compressed as it is made and written in chunks of about PNG_CHUNK_SIZE bytes.
+
+    :param stream: Binary file or anything with write()
+    :param level: zlib compression level
+    """
+    def chunk(kind, data):
+        stream.write(struct.pack('>I', len(data)) + kind + data +
+                     struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    imageWidth, imageHeight = imageSize(maze, cellSize, wallSize)
+    stream.write(b'\x89PNG\r\n\x1a\n')
+    chunk(b'IHDR', struct.pack('>IIBBBBB', imageWidth, imageHeight, 1, 0, 0, 0, 0))
+
+    compressor = zlib.compressobj(level)
+    pending = []
+    pendingSize = 0
+    for packed in packedRows(maze, cellSize, wallSize, PAPER_DIGITS):
+        data = compressor.compress(b'\x00' + packed)
+        if data:
+            pending.append(data)
+            pendingSize += len(data)
+            if pendingSize >= PNG_CHUNK_SIZE:
+                chunk(b'IDAT', b''.join(pending))
+                pending = []
+                pendingSize = 0
+    pending.append(compressor.flush())
+    chunk(b'IDAT', b''.join(pending))
+    chunk(b'IEND', b'')
+
+
+def writeSvg(maze, stream, cellSize=8, wallSize=2, segmentsPerPath=1000):
+    """
+    Write a maze as an SVG image. Runs of walls along the same line are merged into one segment,
+    horizontal runs within a line and vertical runs across the rows, so only one row and the
+    open vertical runs are kept in memory.
+
+    :param stream: Binary file or anything with write()
+    :param segmentsPerPath: Segments written in each <path> element
+    """
+    imageWidth, imageHeight = imageSize(maze, cellSize, wallSize)
+    offset = wallSize / 2
+    stream.write(('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">\n'
+                  '<rect width="100%%" height="100%%" fill="white"/>\n'
+                  '<g stroke="black" stroke-width="%d" stroke-linecap="square" fill="none">\n'
+                  % (imageWidth, imageHeight, imageWidth, imageHeight, wallSize)).encode('ascii'))
+
+    segments = []
+
+    def emit(segment):
+        segments.append(segment)
+        if len(segments) >= segmentsPerPath:
+            flush()
+
+    def flush():
+        if segments:
+            stream.write(('<path d="%s"/>\n' % ''.join(segments)).encode('ascii'))
+            segments.clear()
+
+    openRuns = {}
+    previous = 0
+    for row, horizontal, vertical in wallLines(maze):
+        y = row * cellSize + offset
+        for run in re.finditer(b'\x01+', horizontal):
+            emit('M%g %gh%d' % (run.start() * cellSize + offset, y, (run.end() - run.start()) * cellSize))
+
+        # Vertical runs only start or end where a column differs from the row above
+        current = int.from_bytes(vertical, 'little')
+        changes = (current ^ previous).to_bytes(len(vertical), 'little')
+        previous = current
+        for change in re.finditer(b'[^\x00]', changes):
+            col = change.start()
+            if vertical[col]:
+                openRuns[col] = row
+            else:
+                startRow = openRuns.pop(col)
+                emit('M%g %gv%d' % (col * cellSize + offset, startRow * cellSize + offset,
+                                    (row - startRow) * cellSize))
+    flush()
+    stream.write(b'</g>\n</svg>\n')
+
+
+IMAGE_WRITERS = {
+    '.png': writePng,
+    '.pbm': writePbm,
+    '.svg': writeSvg,
+}
+
+
+def saveImage(maze, path, cellSize=8, wallSize=2):
+    """
+    Render a maze to an image file, the format chosen by the extension of path (see IMAGE_WRITERS)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in IMAGE_WRITERS:
+        raise ValueError(f"Unknown image format {extension!r}, use one of {', '.join(IMAGE_WRITERS)}")
+    with open(path, 'wb') as file:
+        IMAGE_WRITERS[extension](maze, file, cellSize, wallSize)
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Command line front end: python -m mazes <command> ...
+
+  generate  - carve a maze and write it as a maze file or an image
+  solve     - find the path through a maze file
+  render    - draw a maze file as an image
+  stats     - describe a maze file
+  gui       - start one of the interactive front ends
+
+Only the gui command imports PyQt5, ursina or vpython, so everything else starts quickly and
+works without a display. A file name of - means standard input or output.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import runpy
+import sys
+
+from mazegen import Maze, GENERATORS, SOLVERS, IMAGE_WRITERS
+from mazeanalysis import analyze
+
+# The first of each list is the default
+IMAGE_FORMATS = ['png'] + [extension[1:] for extension in IMAGE_WRITERS if extension != '.png']
+GENERATE_FORMATS = ['maze'] + IMAGE_FORMATS
+
+GUIS = {
+    'qt': 'mazesqt',
+    'ursina': 'mazesurs',
+    'vpython': 'mazesvp',
+}
+
+@contextlib.contextmanager
+def openOutput(path):
+    if path == '-':
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+    else:
+        with open(path, 'wb') as file:
+            yield file
+
+
+def loadMaze(path, mapped=False):
+    """
+    :param mapped: Memory map the file if it is one, see Maze.load
+    """
+    if path == '-':
+        return Maze.load(sys.stdin.buffer)
+    return Maze.load(path, mapped)
+
+
+def outputFormat(args, formats):
+    """
+    :return: The format asked for, or else the one matching the output file extension, or else the first of formats
+    """
+    if args.format:
+        return args.format
+    extension = os.path.splitext(args.output)[1][1:].lower()
+    return extension if extension in formats else formats[0]
+
+
+def writeMaze(maze, args, formats):
+    fmt = outputFormat(args, formats)
+    with openOutput(args.output) as stream:
+        if fmt == 'maze':
+            maze.save(stream)
+        else:
+            IMAGE_WRITERS['.' + fmt](maze, stream, args.cell_size, args.wall_size)
+
+
+def positiveInt(text):
+    """
+    :return: int of text, which must be at least 1
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {value}')
+    return value
+
+
+def loopCount(text):
+    """
+    :return: int for a number of loops, or float for a fraction of the cells given as 0.1 or 10%
+    """
+    if text.endswith('%'):
+        return float(text[:-1]) / 100
+    if '.' in text:
+        return float(text)
+    return int(text)
+
+
+def generate(args):
+    seed = args.seed
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+
+    maze = Maze(args.width, args.height)
+    maze.collectStats(args.stats)
+    maze.generate(args.algorithm, loops=args.loops, seed=seed, deadEndsFirst=args.dead_ends_first)
+    writeMaze(maze, args, GENERATE_FORMATS)
+    printStats(maze)
+
+
+def solve(args):
+    maze = loadMaze(args.input)
+    maze.collectStats(args.stats)
+    path = maze.solve(args.algorithm)
+    if args.length:
+        print(len(path))
+    else:
+        for index in path:
+            print(*divmod(index, maze.width))
+    printStats(maze)
+
+
+def printStats(maze):
+    """
+    Print the collected MazeStats metrics as JSON on standard error, if any
+    """
+    if maze.stats is not None:
+        print(json.dumps(maze.stats.metrics()), file=sys.stderr)
+
+
+def render(args):
+    maze = loadMaze(args.input, mapped=True)
+    try:
+        writeMaze(maze, args, IMAGE_FORMATS)
+    finally:
+        if hasattr(maze, 'close'):
+            maze.close()
+
+
+def stats(args):
+    maze = loadMaze(args.input, mapped=True)
+    try:
+        result = {
+            'width': maze.width,
+            'height': maze.height,
+            'algorithm': maze.algorithm,
+            'seed': maze.seed,
+        }
+        result.update(analyze(maze, paths=args.paths, corridors=args.corridors))
+    finally:
+        if hasattr(maze, 'close'):
+            maze.close()
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f'{key}: {value}')
+
+
+def gui(args):
+    sys.argv = [GUIS[args.frontend]] + args.arguments
+    runpy.run_module(GUIS[args.frontend], run_name='__main__')
+
+
+def addOutputArguments(parser, formats):
+    parser.add_argument('-o', '--output', default='-', help='Output file, - for standard output (default)')
+    parser.add_argument('-f', '--format', choices=formats,
+                        help=f'Output format, by default from the output extension or else {formats[0]}')
+    parser.add_argument('--cell-size', type=int, default=8, help='Image pixels per cell')
+    parser.add_argument('--wall-size', type=int, default=2, help='Image wall thickness in pixels')
+
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog='mazes', description='Generate, solve and draw mazes')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log every step on standard error')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('generate', help='Carve a new maze')
+    command.add_argument('width', type=positiveInt)
+    command.add_argument('height', type=positiveInt)
+    command.add_argument('-a', '--algorithm', choices=list(GENERATORS), default='backtracker')
+    command.add_argument('-l', '--loops', type=loopCount, default=0,
+                         help='Extra walls to remove, or a fraction of the number of cells as 0.05 or 5%%')
+    command.add_argument('--dead-ends-first', action='store_true', help='Remove the loop walls from dead ends first')
+    command.add_argument('-s', '--seed', type=int, help='Random seed, chosen at random by default')
+    addOutputArguments(command, GENERATE_FORMATS)
+    command.add_argument('--stats', action='store_true', help='Print counters and timings as JSON on standard error')
+    command.set_defaults(run=generate)
+
+    command = commands.add_parser('solve', help='Print the path through a maze, one row and column per line')
+    command.add_argument('input', help='Maze file, - for standard input')
+    command.add_argument('-a', '--algorithm', choices=list(SOLVERS), default='astar')
+    command.add_argument('--length', action='store_true', help='Only print the number of cells on the path')
+    command.add_argument('--stats', action='store_true', help='Print counters and timings as JSON on standard error')
+    command.set_defaults(run=solve)
+
+    command = commands.add_parser('render', help='Draw a maze file as an image')
+    command.add_argument('input', help='Maze file, - for standard input')
+    addOutputArguments(command, IMAGE_FORMATS)
+    command.set_defaults(run=render)
+
+    command = commands.add_parser('stats', help='Describe a maze file')
+    command.add_argument('input', help='Maze file, - for standard input')
+    command.add_argument('--json', action='store_true', help='Print a JSON object')
+    command.add_argument('--paths', action='store_true',
+                         help='Also measure the diameter and solution, slow for large mazes')
+    command.add_argument('--corridors', action='store_true', help='Also measure corridor lengths, slow for large mazes')
+    command.set_defaults(run=stats)
+
+    command = commands.add_parser('gui', help='Start an interactive front end')
+    command.add_argument('frontend', choices=list(GUIS))
+    command.add_argument('arguments', nargs=argparse.REMAINDER, help='Passed on to the front end')
+    command.set_defaults(run=gui)
+
+    return parser
+
+
+def main(argv=None):
+    parser = makeParser()
+    args = parser.parse_args(argv)
+    # Checked before any output file is opened, and so truncated
+    if 'cell_size' in args and not 0 < args.wall_size < args.cell_size:
+        parser.error('--wall-size must be more than 0 and less than --cell-size')
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    try:
+        args.run(args)
+    except BrokenPipeError:
+        # The reader went away, as with head. Don't complain again when the interpreter flushes stdout.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except (ValueError, OSError) as error:
+        # Bad or missing maze files
+        sys.exit(f'mazes: {error}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Local maze service, so many game servers can share one maze backend instead of each carving
+mazes in process.
+
+  python -m mazeservice serve --port 8765 --workers 4 --cache /tmp/mazes
+  python -m mazeservice request --port 8765 generate '{"width": 100, "height": 100, "seed": 7}' -o maze.maze
+  python -m mazeservice request --port 8765 render '{"width": 100, "height": 100, "seed": 7}' -o maze.png
+
+Requests are a line of JSON each, over TCP or a Unix socket:
+  {"command": "generate", "spec": {...}}
+  {"command": "solve", "spec": {...}, "algorithm": "astar"}
+  {"command": "render", "spec": {...}, "format": "png", "cellSize": 8, "wallSize": 2}
+where spec is as for mazebatch.generateState. A spec without a seed is given a random one.
+
+Each response is a line of JSON, {"ok": true, ...} or {"ok": false, "error": ...}, and after a
+good one the payload as chunks, each a 4 byte big endian length and that many bytes, ending with
+an empty chunk:
+  generate - the header fields of Maze.getState(), then the wall masks packed two cells per byte
+  solve    - {"cells": n}, then the cell indexes on the path as 32 bit integers, native byte order
+  render   - {"format": ...}, then the image file
+
+The mazes are made in a bounded pool of worker processes, each with a MazeCache, on disk if the
+service has a cache directory. Images are written by the worker straight to a temporary file,
+which the service streams from, so no image is ever held in memory whole. Identical requests
+already in progress share one job. When as many jobs as maxPending are waiting the service
+answers busy at once, rather than letting the queue and the latency grow.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from mazegen import Maze, SOLVERS, IMAGE_WRITERS, encodeHeader
+from mazecache import MazeCache, normalizeSpec, specKey
+
+CHUNK_SIZE = 1 << 16
+CHUNK_HEADER = struct.Struct('>I')
+# Largest maze a request may ask for
+MAX_CELLS = 4000 * 4000
+
+COMMANDS = ('generate', 'solve', 'render')
+RENDER_FORMATS = [extension[1:] for extension in IMAGE_WRITERS]
+
+# The MazeCache of a worker process
+workerCache = None
+
+
+class ServiceError(Exception):
+    """
+    A request the service can't do, reported to the client
+    """
+
+
+# ------------------------------------------------------------------------------------------
+# Jobs, run in the worker processes
+# ------------------------------------------------------------------------------------------
+
+def initWorker(directory, maxDiskBytes):
+    global workerCache
+    workerCache = MazeCache(directory=directory, maxDiskBytes=maxDiskBytes)
+
+
+def generateJob(spec):
+    """
+    :return: Maze.getState() of the maze
+    """
+    return workerCache.getState(spec)
+
+
+def solveJob(spec, algorithm):
+    """
+    :return: bytes of the array of cell indexes on the path
+    """
+    return workerCache.solution(spec, algorithm).tobytes()
+
+
+def renderJob(spec, fmt, cellSize, wallSize):
+    """
+    :return: Path of a temporary file holding the image, for openRendered
+    """
+    handle, path = tempfile.mkstemp(prefix='maze-', suffix='.' + fmt)
+    try:
+        with open(handle, 'wb') as file:
+            IMAGE_WRITERS['.' + fmt](workerCache.getMaze(spec), file, cellSize, wallSize)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def openRendered(path):
+    """
+    Open the image a renderJob wrote and remove its name, so the file goes when the last request
+    sharing it is done with it and it is closed
+
+    :return: The open file
+    """
+    file = open(path, 'rb')
+    os.remove(path)
+    return file
+
+
+# ------------------------------------------------------------------------------------------
+# Server
+# ------------------------------------------------------------------------------------------
+
+class MazeService:
+    def __init__(self, workers=None, maxPending=64, cacheDirectory=None, maxDiskBytes=1 << 30,
+                 chunkSize=CHUNK_SIZE, maxCells=MAX_CELLS):
+        """
+        :param workers: Worker processes, by default one per CPU
+        :param maxPending: Most jobs waiting or running before requests are turned away
+        :param cacheDirectory: Directory the workers share for their MazeCache, None for memory only
+        """
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initWorker,
+                                            initargs=(cacheDirectory, maxDiskBytes))
+        self.maxPending = maxPending
+        self.chunkSize = chunkSize
+        self.maxCells = maxCells
+        # Futures of the jobs in progress, by request key
+        self.inFlight = {}
+        self.servers = []
+        # Writer of each open connection, by the task handling it
+        self.connections = {}
+        self.served = 0
+        self.merged = 0
+        self.rejected = 0
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """
+        Listen on a Unix socket at path if given, otherwise on TCP host and port
+
+        :return: The asyncio server
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        self.servers.append(server)
+        return server
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+        # Closing the connections ends their handlers at the next request
+        for writer in self.connections.values():
+            writer.close()
+        if self.connections:
+            await asyncio.wait(list(self.connections), timeout=5)
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers = []
+        self.executor.shutdown(cancel_futures=True)
+
+    def parseSpec(self, request):
+        spec = request.get('spec')
+        if not isinstance(spec, dict):
+            raise ServiceError('The request needs a spec object')
+        spec = dict(spec)
+        width, height = spec.get('width'), spec.get('height')
+        if not isinstance(width, int) or not isinstance(height, int) or width < 1 or height < 1:
+            raise ServiceError('The spec needs a positive integer width and height')
+        if width * height > self.maxCells:
+            raise ServiceError(f'Mazes are limited to {self.maxCells} cells')
+        if spec.get('seed') is None:
+            spec['seed'] = random.SystemRandom().getrandbits(32)
+        try:
+            return normalizeSpec(spec)
+        except (TypeError, ValueError) as error:
+            raise ServiceError(str(error))
+
+    def job(self, request):
+        """
+        :return: (key, function, arguments) of the job a request needs
+        """
+        command = request.get('command')
+        spec = self.parseSpec(request)
+        key = specKey(spec)
+        if command == 'generate':
+            return (command, key), generateJob, (spec,)
+        if command == 'solve':
+            algorithm = request.get('algorithm', 'astar')
+            if algorithm not in SOLVERS:
+                raise ServiceError(f'Unknown solver {algorithm}')
+            return (command, key, algorithm), solveJob, (spec, algorithm)
+        if command == 'render':
+            fmt = request.get('format', 'png')
+            cellSize = request.get('cellSize', 8)
+            wallSize = request.get('wallSize', 2)
+            if fmt not in RENDER_FORMATS:
+                raise ServiceError(f'Unknown format {fmt}')
+            if not isinstance(cellSize, int) or not isinstance(wallSize, int) or not 0 < wallSize < cellSize <= 64:
+                raise ServiceError('wallSize must be at least 1 and less than cellSize, at most 64')
+            return (command, key, fmt, cellSize, wallSize), renderJob, (spec, fmt, cellSize, wallSize)
+        raise ServiceError(f"Unknown command {command}, expected one of {', '.join(COMMANDS)}")
+
+    async def run(self, key, function, arguments):
+        """
+        Run a job in the pool, or wait for the identical one already running
+
+        :return: What the job returned
+        """
+        future = self.inFlight.get(key)
+        if future is not None:
+            self.merged += 1
+        else:
+            if len(self.inFlight) >= self.maxPending:
+                self.rejected += 1
+                raise ServiceError('busy')
+            future = asyncio.ensure_future(self.execute(function, arguments))
+            self.inFlight[key] = future
+            future.add_done_callback(lambda _done: self.inFlight.pop(key, None))
+        # Shielded, so a client going away doesn't cancel the job for the others waiting on it
+        return await asyncio.shield(future)
+
+    async def execute(self, function, arguments):
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, function, *arguments)
+        # Opened once here, every request sharing the job reads it with its own offsets
+        return openRendered(result) if function is renderJob else result
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ServiceError('A request is a JSON object')
+                    key, function, arguments = self.job(request)
+                    result = await self.run(key, function, arguments)
+                except (ServiceError, ValueError) as error:
+                    await self.reply(writer, {'ok': False, 'error': str(error)})
+                    continue
+                except Exception as error:
+                    await self.reply(writer, {'ok': False, 'error': f'{type(error).__name__}: {error}'})
+                    continue
+
+                header, payload = self.response(key[0], result, request)
+                await self.reply(writer, header, payload)
+                self.served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    def response(self, command, result, request):
+        """
+        :return: (header, payload) answering a request, the payload bytes or an open file
+        """
+        if command == 'generate':
+            header = {name: value for name, value in result.items() if name != 'walls'}
+            return header, result['walls']
+        if command == 'solve':
+            return {'cells': len(result) // 4}, result
+        return {'format': request.get('format', 'png')}, result
+
+    async def reply(self, writer, header, payload=None):
+        """
+        Write the header line, then the payload in chunks, waiting for the client to take each
+        one so a slow reader holds up only its own connection
+        """
+        writer.write(json.dumps({'ok': True, **header}).encode('utf-8') + b'\n')
+        if payload is not None:
+            for chunk in self.chunks(payload):
+                writer.write(CHUNK_HEADER.pack(len(chunk)))
+                writer.write(chunk)
+                await writer.drain()
+            writer.write(CHUNK_HEADER.pack(0))
+        await writer.drain()
+
+    def chunks(self, payload):
+        """
+        :param payload: bytes, or a file read with pread so requests sharing it don't share a position
+        :return: Generator of the payload in chunks of up to chunkSize bytes
+        """
+        if isinstance(payload, (bytes, bytearray)):
+            view = memoryview(payload)
+            for offset in range(0, len(view), self.chunkSize):
+                yield view[offset:offset + self.chunkSize]
+            return
+        offset = 0
+        while True:
+            chunk = os.pread(payload.fileno(), self.chunkSize, offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+
+# ------------------------------------------------------------------------------------------
+# Client
+# ------------------------------------------------------------------------------------------
+
+class MazeClient:
+    """
+    Connection to a MazeService, one request at a time
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8765, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def request(self, request):
+        """
+        Send a request and read the header of the response
+
+        :return: The header. Call chunks() next to read the payload.
+        :raises ServiceError: If the service turned the request down
+        """
+        self.writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('The service closed the connection')
+        header = json.loads(line)
+        if not header['ok']:
+            raise ServiceError(header['error'])
+        return header
+
+    async def chunks(self):
+        """
+        :return: Async generator of the payload chunks of the response just read
+        """
+        while True:
+            size = CHUNK_HEADER.unpack(await self.reader.readexactly(CHUNK_HEADER.size))[0]
+            if not size:
+                return
+            yield await self.reader.readexactly(size)
+
+    async def fetch(self, request):
+        """
+        :return: (header, whole payload)
+        """
+        header = await self.request(request)
+        payload = bytearray()
+        async for chunk in self.chunks():
+            payload += chunk
+        return header, bytes(payload)
+
+    async def generate(self, spec):
+        """
+        :return: The Maze for spec
+        """
+        state, walls = await self.fetch({'command': 'generate', 'spec': spec})
+        del state['ok']
+        state['walls'] = walls
+        return Maze.fromState(state)
+
+    async def solve(self, spec, algorithm='astar'):
+        """
+        :return: List of the cell indexes on the path through the maze for spec
+        """
+        _header, path = await self.fetch({'command': 'solve', 'spec': spec, 'algorithm': algorithm})
+        return list(memoryview(path).cast('i'))
+
+    async def render(self, spec, fmt='png', cellSize=8, wallSize=2):
+        """
+        :return: The image file, as bytes
+        """
+        _header, image = await self.fetch({'command': 'render', 'spec': spec, 'format': fmt,
+                                           'cellSize': cellSize, 'wallSize': wallSize})
+        return image
+
+
+# ------------------------------------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------------------------------------
+
+async def serveCommand(args):
+    service = MazeService(args.workers, args.max_pending, args.cache)
+    server = await service.start(args.host, args.port, args.socket)
+    print('Serving on', ', '.join(str(socket.getsockname()) for socket in server.sockets), file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+async def requestCommand(args):
+    client = await MazeClient.connect(args.host, args.port, args.socket)
+    try:
+        message = {'command': args.command, 'spec': json.loads(args.spec)}
+        if args.command == 'solve':
+            message['algorithm'] = args.algorithm
+        elif args.command == 'render':
+            message['format'] = args.format
+        header = await client.request(message)
+        if args.command == 'generate':
+            # Written as a maze file as the chunks come in
+            state = dict(header, walls=b'')
+            del state['ok']
+            prefix = encodeHeader(state)
+        else:
+            prefix = b''
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            output.write(prefix)
+            async for chunk in client.chunks():
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+    finally:
+        await client.close()
+
+
+def main(argv=None):
+    # Where to listen or connect, given after the command as in serve --port 8765
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument('--host', default='127.0.0.1')
+    connection.add_argument('--port', type=int, default=8765)
+    connection.add_argument('--socket', help='Unix socket path, instead of TCP')
+
+    parser = argparse.ArgumentParser(prog='mazeservice', description='Local maze generation service')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    command = commands.add_parser('serve', parents=[connection], help='Run the service')
+    command.add_argument('--workers', type=int, help='Worker processes, one per CPU by default')
+    command.add_argument('--max-pending', type=int, default=64, help='Jobs queued before answering busy')
+    command.add_argument('--cache', help='Directory for the shared maze cache')
+    command.set_defaults(run=serveCommand)
+
+    command = commands.add_parser('request', parents=[connection], help='Send one request and write the payload')
+    command.add_argument('command', choices=COMMANDS)
+    command.add_argument('spec', help='JSON spec, as {"width": 10, "height": 10, "seed": 1}')
+    command.add_argument('-a', '--algorithm', choices=list(SOLVERS), default='astar')
+    command.add_argument('-f', '--format', choices=RENDER_FORMATS, default='png')
+    command.add_argument('-o', '--output', default='-', help='Output file, - for standard output (default)')
+    command.set_defaults(run=requestCommand)
+
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(args.run(args))
+    except (ServiceError, OSError) as error:
+        sys.exit(f'mazeservice: {error}')
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Many naive maze solvers at once: right hand and left hand wall followers, and the Pledge
+algorithm, each agent with its own start and heading.
+
+The agents work on their own copy of the wall masks, with the boundary closed, and never touch
+the visited or traversed marks of the maze. Agents following the same rule advance together.
+Their positions are a list and their headings a bytes object, and each step looks up every
+agent's new heading at once with bytes.translate on heading << 4 | wall mask, then moves them
+with map(). Pledge agents carry a turn count each, so they are stepped one by one.
+
+An agent stops when it reaches the finish cell or when it is found going round a cycle,
+detected with Brent's algorithm on its (position, heading, turn count) state.
+"""
+
+import operator
+from array import array
+
+from mazegen import Cell
+from mazeanalysis import closedWalls, stepOffsets
+
+RULES = ('right', 'left', 'pledge')
+
+# Turns tried, in order, relative to the heading. Directions go clockwise, so +1 is to the right.
+TURN_ORDER = {
+    'right': (1, 0, 3, 2),
+    'left': (3, 0, 1, 2),
+    # A Pledge agent meeting a wall turns left until it is free, keeping the wall on its right
+    'blocked': (3, 2, 1),
+}
+
+
+def turnTable(order):
+    """
+    :return: 256 byte table from heading << 4 | wall mask to the new heading. A cell with no open
+             wall keeps the heading, though no agent can get into one.
+    """
+    table = bytearray(256)
+    for heading in range(4):
+        for mask in range(16):
+            table[heading << 4 | mask] = heading
+            for turn in order:
+                direction = (heading + turn) % 4
+                if not mask >> direction & 1:
+                    table[heading << 4 | mask] = direction
+                    break
+    return bytes(table)
+
+
+TURN_TABLES = {rule: turnTable(order) for rule, order in TURN_ORDER.items()}
+
+# Change to the Pledge turn count by (new heading - old heading) % 4, following the wall by the
+# right hand rule and on meeting a wall. Turning back at a dead end is two left turns.
+PLEDGE_TURNS = (0, 1, -2, -1)
+BLOCKED_TURNS = (0, -3, -2, -1)
+
+
+class Flock:
+    """
+    The agents following one rule that are still going
+    """
+
+    def __init__(self, simulation, rule, agents, positions, headings):
+        self.simulation = simulation
+        self.rule = rule
+        self.agents = agents
+        self.positions = positions
+        self.headings = bytes(headings)
+        # Pledge agents head back to the direction they started in whenever their turns add up to 0
+        self.mainHeadings = self.headings
+        self.turns = [0] * len(agents)
+        self.tick = 0
+        # Brent's cycle detection, the same power and distance for every agent since they move together
+        self.power = 1
+        self.distance = 0
+        self.saved = self.states()
+
+    def states(self):
+        return list(zip(self.positions, self.headings, self.turns))
+
+    def step(self):
+        if self.rule == 'pledge':
+            self.stepPledge()
+        else:
+            walls = self.simulation.walls
+            count = len(self.positions)
+            masks = bytes(map(walls.__getitem__, self.positions))
+            # Headings are below 4 and masks below 16, so no byte carries into the next
+            keys = (int.from_bytes(self.headings, 'little') << 4 | int.from_bytes(masks, 'little')).to_bytes(count, 'little')
+            self.headings = keys.translate(TURN_TABLES[self.rule])
+            self.positions = list(map(operator.add, self.positions, map(self.simulation.offsets.__getitem__, self.headings)))
+        self.tick += 1
+
+        finish = self.simulation.finishIndex
+        arrived = bytes(map(finish.__eq__, self.positions)) if finish >= 0 else b''
+        self.distance += 1
+        length = self.distance
+        states = self.states()
+        cycling = bytes(map(operator.eq, states, self.saved))
+        if self.distance == self.power:
+            self.saved = states
+            self.power *= 2
+            self.distance = 0
+
+        if 1 in arrived or 1 in cycling:
+            self.stop(arrived, cycling, length)
+
+    def stepPledge(self):
+        walls = self.simulation.walls
+        offsets = self.simulation.offsets
+        following = TURN_TABLES['right']
+        blocked = TURN_TABLES['blocked']
+        positions = self.positions
+        turns = self.turns
+        headings = bytearray(self.headings)
+        for agent, (position, heading, main) in enumerate(zip(positions, headings, self.mainHeadings)):
+            mask = walls[position]
+            if turns[agent]:
+                turned = following[heading << 4 | mask]
+                turns[agent] += PLEDGE_TURNS[(turned - heading) % 4]
+                heading = turned
+            elif mask >> main & 1:
+                # The turns add up to 0 so the heading is the main one, and there's a wall ahead
+                turned = blocked[heading << 4 | mask]
+                turns[agent] += BLOCKED_TURNS[(turned - heading) % 4]
+                heading = turned
+            else:
+                heading = main
+            headings[agent] = heading
+            positions[agent] = position + offsets[heading]
+        self.headings = bytes(headings)
+
+    def stop(self, arrived, cycling, length=0):
+        """
+        Record the agents that arrived or are going round a cycle of length steps, and drop them
+        from the flock
+        """
+        simulation = self.simulation
+        keep = []
+        for index, agent in enumerate(self.agents):
+            if arrived and arrived[index]:
+                simulation.reached[agent] = 1
+            elif cycling[index]:
+                simulation.cycles[agent] = length
+            else:
+                keep.append(index)
+                continue
+            simulation.steps[agent] = self.tick
+            simulation.position[agent] = self.positions[index]
+
+        self.agents = [self.agents[index] for index in keep]
+        self.positions = [self.positions[index] for index in keep]
+        self.headings = bytes(self.headings[index] for index in keep)
+        self.mainHeadings = bytes(self.mainHeadings[index] for index in keep)
+        self.turns = [self.turns[index] for index in keep]
+        self.saved = [self.saved[index] for index in keep]
+
+
+class Simulation:
+    """
+    Agents walking a maze, each by one of RULES.
+
+    After run(), per agent:
+      steps    - moves made until it reached the finish, was found cycling, or the run ended
+      reached  - 1 if it reached the finish
+      cycles   - length of the cycle it was caught in, 0 if none
+      position - cell index where it stopped, or is now
+    """
+
+    def __init__(self, maze, starts=None, rules='right', headings=None):
+        """
+        :param maze: Maze, MappedMaze or Maze.getState() dictionary
+        :param starts: Cell index of each agent, by default one agent at the maze start
+        :param rules: Rule of every agent, or a list with the rule of each
+        :param headings: Direction each agent starts facing, by default into the maze from the
+                         entrance. Pledge agents keep coming back to this direction.
+        """
+        self.width, self.height, self.walls, startIndex, self.finishIndex = closedWalls(maze)
+        self.offsets = stepOffsets(self.width)
+        entrance = maze['entrance'] if isinstance(maze, dict) else maze.entrance
+
+        if starts is None:
+            starts = [max(startIndex, 0)]
+        count = len(starts)
+        if isinstance(rules, str):
+            rules = [rules] * count
+        if headings is None:
+            headings = [Cell.EAST if entrance is None else (entrance + 2) % 4] * count
+
+        self.count = count
+        self.startPositions = list(starts)
+        self.steps = array('l', [0]) * count
+        self.reached = bytearray(count)
+        self.cycles = array('l', [0]) * count
+        self.position = array('l', starts)
+        self.tick = 0
+
+        self.flocks = []
+        for rule in RULES:
+            agents = [agent for agent in range(count) if rules[agent] == rule]
+            if agents:
+                self.flocks.append(Flock(self, rule, agents, [starts[agent] for agent in agents],
+                                         [headings[agent] for agent in agents]))
+        for flock in self.flocks:
+            flock.stop(bytes(map(self.finishIndex.__eq__, flock.positions)), bytes(len(flock.agents)))
+
+    def active(self):
+        return sum(len(flock.agents) for flock in self.flocks)
+
+    def step(self):
+        """
+        Move every agent still going one cell
+        """
+        for flock in self.flocks:
+            if flock.agents:
+                flock.step()
+        self.tick += 1
+
+    def run(self, maxSteps=None):
+        """
+        Step until every agent has stopped, or for maxSteps. By default that is enough for any
+        wall follower to reach the finish or be found cycling.
+
+        :return: self
+        """
+        if maxSteps is None:
+            maxSteps = 16 * self.width * self.height + 16
+        while self.tick < maxSteps and self.active():
+            self.step()
+        for flock in self.flocks:
+            for agent, position in zip(flock.agents, flock.positions):
+                self.steps[agent] = flock.tick
+                self.position[agent] = position
+        return self
+
+    def summary(self):
+        """
+        :return: Dictionary of totals over the agents
+        """
+        reached = [self.steps[agent] for agent in range(self.count) if self.reached[agent]]
+        return {
+            'agents': self.count,
+            'reached': len(reached),
+            'cycling': sum(1 for length in self.cycles if length),
+            'unfinished': self.active(),
+            'meanSteps': sum(reached) / len(reached) if reached else None,
+            'maxSteps': max(reached) if reached else None,
+        }
+
+
+def simulate(maze, starts=None, rules='right', headings=None, maxSteps=None):
+    """
+    Run a Simulation
+
+    :return: The finished Simulation
+    """
+    return Simulation(maze, starts, rules, headings).run(maxSteps)
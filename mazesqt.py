@@ -6,116 +6,434 @@ Licence: GPL3
 
 
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, \
-    QVBoxLayout, QLabel, QHBoxLayout, QFrame, QLineEdit, QSizePolicy, QCheckBox
+    QVBoxLayout, QLabel, QHBoxLayout, QFrame, QLineEdit, QSizePolicy, QCheckBox, QComboBox, QSpinBox, \
+    QMessageBox
 
 
-from PyQt5.QtGui import QPainter,  QColor
+from PyQt5.QtCore import QLineF, QRectF, QPointF, QObject, QTimer
+from PyQt5.QtGui import QPainter,  QColor, QPixmap
+import queue
 import threading
-import time
 from mazegen import *
+from mazetopology import TOPOLOGIES, LevelsTopology
+
+# Levels of a maze with the levels topology
+LEVELS = 3
+
+# How far inside a cell the traversed wall lines are drawn, they can reach this far into neighbours
+TRAVERSE_OFFSET = 10
+
 
 class MazeWidget(QWidget):
+    """
+    Draws the maze into a cached pixmap, which is rebuilt only when the widget is resized or
+    invalidate() is called for a new maze. Changes to single cells, reported by stepChanged or
+    cellChanged, are patched into the cache and only their area of the widget is repainted.
+    """
 
     def __init__(self, maze):
         super(MazeWidget, self).__init__()
         self.maze = maze
         self.padding = 10
+        self.cache = None
+        self.dirty = set()
+        self.dirtyLock = threading.Lock()
 
-
-    def paintEvent(self, _e):
-        qp = QPainter()
-        qp.begin(self)
-        qp.setBrush(QColor(255,0,0))
-
+    def cellSize(self):
         size = self.size()
         cellWidth = (size.width() - self.padding * 2) / self.maze.width
         cellHeight = (size.height() - self.padding * 2) / self.maze.height
+        return cellWidth, cellHeight
+
+    def squareCells(self):
+        """
+        :return: True if the maze is drawn as a plain grid, otherwise its cells are drawn from the
+                 topology geometry
+        """
+        return self.maze.topology.name in ('rect', 'torus')
+
+    def shapeScale(self):
+        """
+        :return: Widget pixels per unit of the topology geometry
+        """
+        extentWidth, extentHeight = self.maze.topology.extent()
+        size = self.size()
+        return min((size.width() - self.padding * 2) / extentWidth, (size.height() - self.padding * 2) / extentHeight)
+
+    def cellRect(self, index):
+        """
+        :return: Area of the widget that drawing the cell at index can touch
+        """
+        if not self.squareCells():
+            scale = self.shapeScale()
+            corners = self.maze.topology.corners(index)
+            xs = [x for x, _y in corners]
+            ys = [y for _x, y in corners]
+            return QRectF(self.padding + min(xs) * scale - 2, self.padding + min(ys) * scale - 2,
+                          (max(xs) - min(xs)) * scale + 4, (max(ys) - min(ys)) * scale + 4).toAlignedRect()
+
+        cellWidth, cellHeight = self.cellSize()
+        row, col = divmod(index, self.maze.width)
+        margin = TRAVERSE_OFFSET + 2
+        return QRectF(self.padding + cellWidth * col - margin, self.padding + cellHeight * row - margin,
+                      cellWidth + margin * 2, cellHeight + margin * 2).toAlignedRect()
+
+    def invalidate(self):
+        """
+        Throw away the cached drawing, after the maze is initialized or resized
+        """
+        with self.dirtyLock:
+            self.cache = None
+            self.dirty.clear()
+        self.update()
+
+    def cellChanged(self, index):
+        with self.dirtyLock:
+            self.dirty.add(index)
+        self.update(self.cellRect(index))
+
+    def stepChanged(self, step):
+        """
+        Repaint what a step from one of the maze step generators changed
+        """
+        event, index, direction = step
+        if event == CLEAR:
+            self.invalidate()
+            return
+
+        self.cellChanged(index)
+        if event == CARVE:
+            neighbour = self.maze.neighbourIndex(index, direction)
+            if neighbour >= 0:
+                self.cellChanged(neighbour)
+
+    def resizeEvent(self, e):
+        self.cache = None
+        super(MazeWidget, self).resizeEvent(e)
+
+    def drawCell(self, qp, rowIndex, cellIndex, cellWidth, cellHeight):
+        cell = self.maze.cells[rowIndex][cellIndex]
+        cellTopY = self.padding + cellHeight * rowIndex
+        cellLeftX = self.padding + cellWidth * cellIndex
+
+        traverseNorthExtra = TRAVERSE_OFFSET
+        traverseSouthExtra = TRAVERSE_OFFSET
+        traverseEastExtra = TRAVERSE_OFFSET
+        traverseWestExtra = TRAVERSE_OFFSET
+
+        if cell.visited:
+            qp.setPen(QColor(0,0,0))
+            qp.drawEllipse(QRectF(cellLeftX + cellWidth / 2, cellTopY + cellHeight / 2, 4, 4))
 
-        for rowIndex, row in enumerate(maze.cells):
-            for cellIndex, cell in enumerate(row):
-                cellTopY = self.padding + cellHeight * rowIndex
-                cellLeftX = self.padding + cellWidth * cellIndex
-                
-                traverseNorthExtra = 10
-                traverseSouthExtra = 10
-                traverseEastExtra = 10
-                traverseWestExtra = 10
-
-                if cell.visited:
-                    qp.drawEllipse(cellLeftX + cellWidth / 2, cellTopY + cellHeight / 2, 4, 4)
-
-                qp.setPen(QColor(0,0,0))
-
-                if cell.walls[Cell.NORTH]:
-                    qp.drawLine(cellLeftX, cellTopY, cellLeftX + cellWidth, cellTopY)
-                    traverseNorthExtra = -10
-
-                if cell.walls[Cell.SOUTH]:
-                    qp.drawLine(cellLeftX, cellTopY + cellHeight, cellLeftX + cellWidth, cellTopY + cellHeight)
-                    traverseSouthExtra = -10
-
-                if cell.walls[Cell.WEST]:
-                    qp.drawLine(cellLeftX, cellTopY, cellLeftX, cellTopY + cellHeight)
-                    traverseWestExtra = -10
-                
-                if cell.walls[Cell.EAST]:
-                    qp.drawLine(cellLeftX + cellWidth, cellTopY, cellLeftX + cellWidth, cellTopY + cellHeight)
-                    traverseEastExtra = -10
-                    
-                qp.setPen(QColor(64,64,255))
-                
-                if cell.wallsTraversed[Cell.NORTH]:
-                    qp.drawLine(cellLeftX - traverseWestExtra, cellTopY + 10, 
-                                        cellLeftX + cellWidth + traverseEastExtra, cellTopY + 10)
-                
-                if cell.wallsTraversed[Cell.SOUTH]:
-                    qp.drawLine(cellLeftX - traverseWestExtra, cellTopY + cellHeight - 10, 
-                                        cellLeftX + cellWidth + traverseEastExtra, cellTopY + cellHeight - 10)
-
-                if cell.wallsTraversed[Cell.WEST]:
-                    qp.drawLine(cellLeftX + 10, cellTopY - traverseNorthExtra, 
-                                cellLeftX + 10, cellTopY + cellHeight + traverseSouthExtra)
-                
-                if cell.wallsTraversed[Cell.EAST]:
-                    qp.drawLine(cellLeftX + cellWidth - 10, cellTopY - traverseNorthExtra, 
-                                cellLeftX + cellWidth - 10, cellTopY + cellHeight + traverseSouthExtra)
+        qp.setPen(QColor(0,0,0))
 
+        if cell.walls[Cell.NORTH]:
+            qp.drawLine(QLineF(cellLeftX, cellTopY, cellLeftX + cellWidth, cellTopY))
+            traverseNorthExtra = -TRAVERSE_OFFSET
+
+        if cell.walls[Cell.SOUTH]:
+            qp.drawLine(QLineF(cellLeftX, cellTopY + cellHeight, cellLeftX + cellWidth, cellTopY + cellHeight))
+            traverseSouthExtra = -TRAVERSE_OFFSET
+
+        if cell.walls[Cell.WEST]:
+            qp.drawLine(QLineF(cellLeftX, cellTopY, cellLeftX, cellTopY + cellHeight))
+            traverseWestExtra = -TRAVERSE_OFFSET
+
+        if cell.walls[Cell.EAST]:
+            qp.drawLine(QLineF(cellLeftX + cellWidth, cellTopY, cellLeftX + cellWidth, cellTopY + cellHeight))
+            traverseEastExtra = -TRAVERSE_OFFSET
+
+        qp.setPen(QColor(64,64,255))
+
+        if cell.wallsTraversed[Cell.NORTH]:
+            qp.drawLine(QLineF(cellLeftX - traverseWestExtra, cellTopY + TRAVERSE_OFFSET,
+                               cellLeftX + cellWidth + traverseEastExtra, cellTopY + TRAVERSE_OFFSET))
+
+        if cell.wallsTraversed[Cell.SOUTH]:
+            qp.drawLine(QLineF(cellLeftX - traverseWestExtra, cellTopY + cellHeight - TRAVERSE_OFFSET,
+                               cellLeftX + cellWidth + traverseEastExtra, cellTopY + cellHeight - TRAVERSE_OFFSET))
+
+        if cell.wallsTraversed[Cell.WEST]:
+            qp.drawLine(QLineF(cellLeftX + TRAVERSE_OFFSET, cellTopY - traverseNorthExtra,
+                               cellLeftX + TRAVERSE_OFFSET, cellTopY + cellHeight + traverseSouthExtra))
+
+        if cell.wallsTraversed[Cell.EAST]:
+            qp.drawLine(QLineF(cellLeftX + cellWidth - TRAVERSE_OFFSET, cellTopY - traverseNorthExtra,
+                               cellLeftX + cellWidth - TRAVERSE_OFFSET, cellTopY + cellHeight + traverseSouthExtra))
+
+    def drawShape(self, qp, index, scale):
+        """
+        Draw a cell of any topology from its corners. The walls up and down of a levels maze are
+        shown as marks in the cell.
+        """
+        topology = self.maze.topology
+        walls = self.maze.wallBits[index]
+
+        def point(x, y):
+            return QPointF(self.padding + x * scale, self.padding + y * scale)
+
+        qp.setPen(QColor(0,0,0))
+        if self.maze.marks.visited(index):
+            qp.drawEllipse(point(*topology.centre(index)), 2, 2)
+        for direction in range(topology.directions):
+            if walls >> direction & 1:
+                ends = topology.wallEnds(index, direction)
+                if ends is not None:
+                    qp.drawLine(QLineF(point(*ends[0]), point(*ends[1])))
+
+        if topology.directions > topology.turns:
+            x, y = topology.centre(index)
+            qp.setPen(QColor(64,64,255))
+            if not walls >> LevelsTopology.UP & 1:
+                qp.drawLine(QLineF(point(x - 0.2, y - 0.1), point(x, y - 0.3)))
+                qp.drawLine(QLineF(point(x, y - 0.3), point(x + 0.2, y - 0.1)))
+            if not walls >> LevelsTopology.DOWN & 1:
+                qp.drawLine(QLineF(point(x - 0.2, y + 0.1), point(x, y + 0.3)))
+                qp.drawLine(QLineF(point(x, y + 0.3), point(x + 0.2, y + 0.1)))
+
+    def rebuildCache(self):
+        self.cache = QPixmap(self.size())
+        self.cache.fill(self.palette().window().color())
+        cellWidth, cellHeight = self.cellSize()
+
+        qp = QPainter(self.cache)
+        qp.setBrush(QColor(255,0,0))
+        if not self.squareCells():
+            scale = self.shapeScale()
+            for index in range(self.maze.width * self.maze.height):
+                self.drawShape(qp, index, scale)
+            qp.end()
+            return
+
+        for rowIndex in range(self.maze.height):
+            for cellIndex in range(self.maze.width):
+                self.drawCell(qp, rowIndex, cellIndex, cellWidth, cellHeight)
         qp.end()
 
+    def patchCache(self, indexes):
+        """
+        Redraw the area around each changed cell, including the parts of neighbouring cells that
+        overlap it
+        """
+        cellWidth, cellHeight = self.cellSize()
+        background = self.palette().window().color()
+        margin = TRAVERSE_OFFSET + 2
+
+        qp = QPainter(self.cache)
+        qp.setBrush(QColor(255,0,0))
+        for index in indexes:
+            rect = self.cellRect(index)
+            qp.setClipRect(rect)
+            qp.fillRect(rect, background)
+
+            if not self.squareCells():
+                # The neighbours share the walls along the edge of the area
+                scale = self.shapeScale()
+                self.drawShape(qp, index, scale)
+                for _direction, neighbour in self.maze.topology.neighbours(index):
+                    self.drawShape(qp, neighbour, scale)
+                continue
+
+            firstRow = max(0, int((rect.top() - self.padding - margin) // cellHeight))
+            lastRow = min(self.maze.height - 1, int((rect.bottom() - self.padding + margin) // cellHeight))
+            firstCol = max(0, int((rect.left() - self.padding - margin) // cellWidth))
+            lastCol = min(self.maze.width - 1, int((rect.right() - self.padding + margin) // cellWidth))
+            for rowIndex in range(firstRow, lastRow + 1):
+                for cellIndex in range(firstCol, lastCol + 1):
+                    self.drawCell(qp, rowIndex, cellIndex, cellWidth, cellHeight)
+        qp.end()
+
+    def paintEvent(self, e):
+        with self.dirtyLock:
+            dirty = self.dirty
+            self.dirty = set()
+
+        if self.cache is None or self.cache.size() != self.size():
+            self.rebuildCache()
+        elif dirty:
+            self.patchCache(dirty)
+
+        qp = QPainter()
+        qp.begin(self)
+        qp.drawPixmap(e.rect(), self.cache, e.rect())
+        qp.end()
+
+
+class AnimationDriver(QObject):
+    """
+    Runs a maze step generator on a worker thread and shows its steps on the GUI thread.
+
+    The generator runs on a private copy of the widget's maze, so the worker never changes what
+    is being painted. It puts steps on a bounded queue, and a QTimer on the GUI thread takes up to
+    stepsPerFrame steps off the queue each frame, replays them onto the widget's maze and hands
+    them to the widget, which merges them into a single repaint. Nothing touches Qt from the worker.
+    """
+
+    QUEUE_SIZE = 10000
+    FINISHED = object()
+
+    def __init__(self, widget, fps=60):
+        super(AnimationDriver, self).__init__()
+        self.widget = widget
+        self.stepsPerFrame = 1
+        self.skipping = False
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.worker = None
+        self.private = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.finished = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(1000 / fps))
+        self.timer.timeout.connect(self.frame)
+
+    def setSpeed(self, stepsPerFrame):
+        self.stepsPerFrame = max(1, stepsPerFrame)
+
+    def skipToEnd(self):
+        """
+        Show the rest of the current run in as few frames as possible
+        """
+        self.skipping = True
+
+    def running(self):
+        return self.worker is not None
+
+    def start(self, makeSteps, finished=None):
+        """
+        Animate the steps of a maze step generator, calling finished on the GUI thread at the end
+
+        :param makeSteps: Called with a copy of the widget's maze to get the step generator
+        """
+        self.stop()
+        self.skipping = False
+        self.cancelled.clear()
+        self.finished = finished
+        self.error = None
+        self.private = Maze.fromState(self.widget.maze.getState())
+        self.worker = threading.Thread(target=self.work, args=(makeSteps,), daemon=True)
+        self.worker.start()
+        self.timer.start()
+
+    def stop(self):
+        """
+        Cancel the current run, waiting for the worker to stop
+        """
+        if self.worker is None:
+            return
+        self.cancelled.set()
+        self.worker.join()
+        self.worker = None
+        self.private = None
+        self.timer.stop()
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.widget.invalidate()
+        self.done()
+
+    def put(self, item):
+        """
+        Queue item for the GUI thread, waiting while the queue is full
+
+        :return: False if the run was cancelled first
+        """
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work(self, makeSteps):
+        try:
+            for step in makeSteps(self.private):
+                if not self.put(step):
+                    return
+        except Exception as error:
+            # Shown by frame() on the GUI thread
+            self.error = error
+        finally:
+            self.put(self.FINISHED)
+
+    def frame(self):
+        maze = self.widget.maze
+        count = maze.width * maze.height if self.skipping else self.stepsPerFrame
+        steps = []
+        finished = False
+        try:
+            while len(steps) < count:
+                step = self.queue.get_nowait()
+                if step is self.FINISHED:
+                    finished = True
+                    break
+                steps.append(step)
+        except queue.Empty:
+            pass
+
+        maze.replay(steps)
+        # Past a point, redrawing everything once is cheaper than patching cell by cell
+        if len(steps) > maze.width * maze.height // 4:
+            self.widget.invalidate()
+        else:
+            for step in steps:
+                self.widget.stepChanged(step)
+
+        if finished:
+            self.timer.stop()
+            self.worker.join()
+            self.worker = None
+            # Where the entrances are and how the maze was made aren't in the steps
+            private, self.private = self.private, None
+            for name in ('start', 'entrance', 'finish', 'exit', 'seed', 'algorithm'):
+                setattr(maze, name, getattr(private, name))
+            if maze.finish is not None:
+                maze.exitCell = maze.cells[maze.finish[0]][maze.finish[1]]
+            if self.error is not None:
+                QMessageBox.warning(self.widget, 'Mazes', f'{type(self.error).__name__}: {self.error}')
+            self.done()
+
+    def done(self):
+        finished, self.finished = self.finished, None
+        if finished is not None:
+            finished()
+
 
-def update(widget):
-    widget.update()
-    time.sleep(1.0 / (widget.maze.height * widget.maze.width) * 5)
-    
-    
 def generate(widget):
+    driver.stop()
     generateButton.setEnabled(False)
     
     rows = int(rowsWidget.text())
     cols = int(colsWidget.text())
     loops = int(loopsWidget.text())
+    algorithm = algorithmWidget.currentText()
 
-    widget.maze.height = rows
-    widget.maze.width = cols
-    widget.maze.initialize()
-    widget.update()
-    
-    threading.Thread(target = lambda: \
-             widget.maze.randomizeBacktracker(loops = loops, 
-                                              callback = lambda: update(widget),
-                                              finished = lambda : generateButton.setEnabled(True),
-                                              )).start()
-    widget.update()
+    topology = topologyWidget.currentText()
+    if topology != widget.maze.topology.name:
+        widget.maze = Maze(cols, rows, topology, LEVELS if topology == 'levels' else 1)
+    else:
+        widget.maze.height = rows * widget.maze.topology.levels
+        widget.maze.width = cols
+        widget.maze.initialize()
+    widget.invalidate()
+
+    driver.start(lambda maze: maze.generateSteps(algorithm, loops = loops), lambda : generateButton.setEnabled(True))
     
     
 def traverserWallToucher(widget):
+    driver.stop()
+    if widget.maze.topology.turns != widget.maze.topology.directions:
+        # Wall following can't go between levels
+        return
     wallToucherButton.setEnabled(False)
     right = rightLeftWidget.checkState()
-    threading.Thread(target = lambda: \
-             widget.maze.wallToucher(rightHand=right, callback = lambda: update(widget),
-                                              finished = lambda : wallToucherButton.setEnabled(True),
-                                              )).start()
-    widget.update()
+    driver.start(lambda maze: maze.wallToucherSteps(rightHand=right), lambda : wallToucherButton.setEnabled(True))
+
+
+def solve(widget):
+    driver.stop()
+    solveButton.setEnabled(False)
+    algorithm = solverWidget.currentText()
+    driver.start(lambda maze: maze.solveSteps(algorithm), lambda : solveButton.setEnabled(True))
 
     
 
@@ -127,6 +445,7 @@ if __name__ == "__main__":
     mazeWidget = MazeWidget(maze)
     mazeWidget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
     layout.addWidget(mazeWidget)
+    driver = AnimationDriver(mazeWidget)
     
     generateButton = QPushButton("Generate")
     layout.addWidget(generateButton)
@@ -147,6 +466,16 @@ if __name__ == "__main__":
     hbox.addWidget(QLabel("Loops"))
     loopsWidget = QLineEdit("0")
     hbox.addWidget(loopsWidget)
+
+    hbox.addWidget(QLabel("Algorithm"))
+    algorithmWidget = QComboBox()
+    algorithmWidget.addItems(GENERATORS.keys())
+    hbox.addWidget(algorithmWidget)
+
+    hbox.addWidget(QLabel("Shape"))
+    topologyWidget = QComboBox()
+    topologyWidget.addItems(TOPOLOGIES.keys())
+    hbox.addWidget(topologyWidget)
     
     paramFrame.setLayout(hbox)
     layout.addWidget(paramFrame)
@@ -166,6 +495,36 @@ if __name__ == "__main__":
     wallToucherButton.clicked.connect(lambda: traverserWallToucher(mazeWidget))
     layout.addWidget(wallToucherFrame)
 
+    solveFrame = QFrame()
+    solveFrame.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+    hbox = QHBoxLayout()
+    solveFrame.setLayout(hbox)
+
+    solveButton = QPushButton("Solve - shortest path")
+    solveButton.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+    hbox.addWidget(solveButton)
+    solverWidget = QComboBox()
+    solverWidget.addItems(SOLVERS.keys())
+    hbox.addWidget(solverWidget)
+
+    solveButton.clicked.connect(lambda: solve(mazeWidget))
+    layout.addWidget(solveFrame)
+
+    speedFrame = QFrame()
+    speedFrame.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+    hbox = QHBoxLayout()
+    speedFrame.setLayout(hbox)
+
+    hbox.addWidget(QLabel("Steps per frame"))
+    speedWidget = QSpinBox()
+    speedWidget.setRange(1, 100000)
+    speedWidget.valueChanged.connect(driver.setSpeed)
+    hbox.addWidget(speedWidget)
+    skipButton = QPushButton("Skip to end")
+    skipButton.clicked.connect(driver.skipToEnd)
+    hbox.addWidget(skipButton)
+    layout.addWidget(speedFrame)
+
     
     window.setLayout(layout)
     window.setGeometry(100, 100, 600, 600)
@@ -6,6 +6,7 @@ Created on Sep 12, 2020
 
 from ursina import *            # import everything we need with one line.
 import logging
+import math
 import sys
 import threading
 from mazegen import Maze, Cell
@@ -14,91 +15,326 @@ from mazegen import Maze, Cell
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
+# The walls are merged into one mesh per square chunk of cells, and a chunk is rebuilt when
+# any wall in it changes
+CHUNK_SIZE = 16
 
+WALL_WIDTH = 0.01
+WALL_HEIGHT = 3
 
+# First person walkthrough. Distances are in cells: the player keeps PLAYER_RADIUS from the walls,
+# and only the chunks with a cell within VIEW_RADIUS of the player are shown.
+WALK_SPEED = 1.5
+TURN_SPEED = 120
+PLAYER_RADIUS = 0.2
+EYE_HEIGHT = 0.4
+VIEW_RADIUS = 24
 
-def generate_walls(maze):
+# Corners and texture coordinates of the faces of a box, as (x, y, z) picks of min (0) or max (1)
+BOX_FACES = (
+    ((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)),
+    ((0, 0, 1), (0, 1, 1), (1, 1, 1), (1, 0, 1)),
+    ((0, 0, 0), (0, 0, 1), (1, 0, 1), (1, 0, 0)),
+    ((0, 1, 0), (1, 1, 0), (1, 1, 1), (0, 1, 1)),
+    ((0, 0, 0), (0, 1, 0), (0, 1, 1), (0, 0, 1)),
+    ((1, 0, 0), (1, 0, 1), (1, 1, 1), (1, 1, 0)),
+)
+FACE_UVS = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+def floor_geometry(maze):
     cellWidth = 2.4 / maze.width
     cellHeight = 2.4 / maze.height
-    wallWidth = 0.01
-    wallHeight = 3
-    
-        #     sphere(pos=vector(0.5,0.5,0.5), radius=0.1)
-        
-        
+    floorPosition = Vec3(cellWidth, cellHeight, 0)
+    floorScale = Vec3(3, 3, 0.2)
+    return cellWidth, cellHeight, floorPosition, floorScale
+
+
+def wall_boxes(maze, rowIndex, cellIndex):
+    """
+    :return: (world position, scale) of each wall standing around a cell. A wall shared by two
+             cells is only returned for the cell west or north of it.
+    """
+    cellWidth, cellHeight, _floorPosition, _floorScale = floor_geometry(maze)
+    cellTopY = cellHeight * rowIndex - 1
+    cellLeftX = cellWidth * cellIndex - 1
+    walls = maze.wallBits[rowIndex * maze.width + cellIndex]
+    boxes = []
+
+    if walls & (1 << Cell.EAST):
+        boxes.append((Vec3(cellLeftX + cellWidth - WALL_WIDTH / 2, cellTopY + cellHeight / 2, 0.4),
+                      Vec3(WALL_WIDTH, cellHeight, WALL_HEIGHT)))
+
+    if walls & (1 << Cell.SOUTH):
+        boxes.append((Vec3(cellLeftX + cellWidth / 2, cellTopY + cellHeight - WALL_WIDTH / 2, 0.4),
+                      Vec3(cellWidth, WALL_WIDTH, WALL_HEIGHT)))
+
+    if walls & (1 << Cell.WEST) and cellIndex == 0:
+        boxes.append((Vec3(cellLeftX - WALL_WIDTH / 2, cellTopY + cellHeight / 2, 0.4),
+                      Vec3(WALL_WIDTH, cellHeight, WALL_HEIGHT)))
+
+    if walls & (1 << Cell.NORTH) and rowIndex == 0:
+        boxes.append((Vec3(cellLeftX + cellWidth / 2, cellTopY - WALL_WIDTH / 2, 0.4),
+                      Vec3(cellWidth, WALL_WIDTH, WALL_HEIGHT)))
+
+    return boxes
+
+
+def floor_point(maze, position):
+    """
+    :return: Floor coordinates of a world position of the unturned floor, as given by wall_boxes
+    """
+    _cellWidth, _cellHeight, floorPosition, floorScale = floor_geometry(maze)
+    return Vec3(*((position[i] - floorPosition[i]) / floorScale[i] for i in range(3)))
+
+
+def build_chunk(maze, chunkRow, chunkCol, mesh):
+    """
+    Fill mesh with all the walls of one chunk, in floor coordinates. Each box face has its own
+    four vertices, shared by its two triangles, so the texture maps onto every face.
+    """
+    vertices = []
+    triangles = []
+    uvs = []
+
+    for rowIndex in range(chunkRow * CHUNK_SIZE, min(maze.height, (chunkRow + 1) * CHUNK_SIZE)):
+        for cellIndex in range(chunkCol * CHUNK_SIZE, min(maze.width, (chunkCol + 1) * CHUNK_SIZE)):
+            for position, scale in wall_boxes(maze, rowIndex, cellIndex):
+                # Same placement as an Entity(parent=floor, world_position=position, scale=scale)
+                centre = floor_point(maze, position)
+                corners = (centre - scale / 2, centre + scale / 2)
+                for face in BOX_FACES:
+                    first = len(vertices)
+                    for pick in face:
+                        vertices.append(Vec3(corners[pick[0]][0], corners[pick[1]][1], corners[pick[2]][2]))
+                    uvs.extend(FACE_UVS)
+                    triangles.extend((first, first + 1, first + 2, first, first + 2, first + 3))
+
+    mesh.vertices = vertices
+    mesh.triangles = triangles
+    mesh.uvs = uvs
+    mesh.generate()
+    return len(vertices) > 0
+
+
+def generate_walls(maze):
+    """
+    Bring the wall meshes up to date with the maze. Only the chunks holding cells that changed
+    since the last call are rebuilt, using the maze change tracking, and while walking only those
+    in view. The others are rebuilt when they come into view.
+    """
+    _cellWidth, _cellHeight, floorPosition, floorScale = floor_geometry(maze)
+
     if not 'floor' in maze.__dict__:
         maze.floor = Entity(model='cube',
-                   world_position=Vec3(cellWidth,cellHeight,0), scale=Vec3(3,3,0.2), background=color.gray)    
-    
-    for rowIndex, row in enumerate(maze.cells):
-        for cellIndex, cell in enumerate(row):
-            cellTopY = cellWidth * rowIndex - 1
-            cellLeftX = cellHeight * cellIndex -1
-            
-            if not 'walls3d' in cell.__dict__:
-                cell.walls3d = {}
-#                 cell.text = text(position=Vec3(cellLeftX + cellWidth / 2,
-#                                 cellTopY + cellHeight / 2 - cellHeight / 6,
-#                                 0.1
-#                                 ),
-#                                 text=f"{rowIndex},{cellIndex}",
-#                                 align='center',
-#                                 height=cellWidth / 3,
-#                                 color=color.red)
-
-            # ------------------
-        
-            #Text(parent=maze.floor, text=f'{rowIndex},{cellIndex}', origin=(cellLeftX,cellTopY), color=color.red)
-        
-            if cell.walls[Cell.EAST] and not Cell.EAST in cell.walls3d:
-                cell.walls3d[Cell.EAST] = Entity(model='cube', parent=maze.floor, texture='crate_texture',
-                    world_position=Vec3(cellLeftX + cellWidth - wallWidth / 2,
-                                          cellTopY + cellHeight / 2,
-                                          0.4),
-                                scale=Vec3(wallWidth, cellHeight / 2, wallHeight)
-                               )
-            elif not cell.walls[Cell.EAST] and Cell.EAST in cell.walls3d:
-                cell.walls3d.pop(Cell.EAST).visible = False
-
-
-            # ------------------
-
-            if cell.walls[Cell.SOUTH] and not Cell.SOUTH in cell.walls3d:
-                cell.walls3d[Cell.SOUTH] = Entity(model='cube', parent=maze.floor, texture='crate_texture',
-                    world_position=Vec3(cellLeftX + cellHeight / 2,
-                                          cellTopY + cellWidth - wallWidth / 2,
-                                          0.4),
-                                scale=Vec3(cellWidth / 2, wallWidth, wallHeight)
-                               )
-            elif not cell.walls[Cell.SOUTH] and Cell.SOUTH in cell.walls3d:
-                cell.walls3d.pop(Cell.SOUTH).visible = False
-
-            # ------------------
-
-            if cell.walls[Cell.WEST] and not Cell.WEST in cell.walls3d:
-                cell.walls3d[Cell.WEST] = Entity(model='cube', parent=maze.floor, texture='crate_texture',
-                    world_position=Vec3(cellLeftX - wallWidth / 2,
-                                          cellTopY + cellHeight / 2,
-                                          0.4),
-                                scale=Vec3(wallWidth, cellHeight / 2, wallHeight)
-                               )
-            elif not cell.walls[Cell.WEST] and Cell.WEST in cell.walls3d:
-                cell.walls3d.pop(Cell.WEST).visible = False
-
-            # ------------------
-                
-            if cell.walls[Cell.NORTH] and not Cell.NORTH in cell.walls3d:
-                cell.walls3d[Cell.NORTH] = Entity(model='cube', parent=maze.floor, texture='crate_texture',
-                    world_position=Vec3(cellLeftX + cellWidth / 2,
-                                          cellTopY - wallWidth / 2,
-                                          0.4),
-                                scale=Vec3(cellWidth / 2, wallWidth, wallHeight)
-                               )
-            elif not cell.walls[Cell.NORTH] and Cell.NORTH in cell.walls3d:
-                cell.walls3d.pop(Cell.NORTH).visible = False
+                   world_position=floorPosition, scale=floorScale, background=color.gray)
+        maze.chunks3d = {}
+        maze.dirty3d = set()
+        # Chunks in view, None for all of them
+        maze.shown3d = None
+        maze.version3d = -1
+        maze.trackChanges()
+
+    maze.version3d, changed = maze.changedSince(maze.version3d)
+    maze.trimChanges(maze.version3d)
+
+    if changed is None:
+        maze.dirty3d = {(chunkRow, chunkCol) for chunkRow in range(-(-maze.height // CHUNK_SIZE))
+                        for chunkCol in range(-(-maze.width // CHUNK_SIZE))}
+    else:
+        maze.dirty3d.update((index // maze.width // CHUNK_SIZE, index % maze.width // CHUNK_SIZE) for index in changed)
+
+    for key in list(maze.dirty3d if maze.shown3d is None else maze.dirty3d & maze.shown3d):
+        update_chunk(maze, key)
 
     return maze.floor
 
+
+def update_chunk(maze, key):
+    """
+    Rebuild the chunk at key = (chunkRow, chunkCol) if it is out of date, and show it if it is in view
+    and has any walls
+    """
+    chunk = maze.chunks3d.get(key)
+
+    if chunk is None:
+        mesh = Mesh(vertices=[], triangles=[], uvs=[], static=False)
+        entity = Entity(model=mesh, parent=maze.floor, texture='crate_texture', double_sided=True)
+        chunk = maze.chunks3d[key] = (entity, mesh)
+        maze.dirty3d.add(key)
+
+    if key in maze.dirty3d:
+        maze.dirty3d.discard(key)
+        build_chunk(maze, key[0], key[1], chunk[1])
+
+    chunk[0].enabled = len(chunk[1].vertices) > 0 and (maze.shown3d is None or key in maze.shown3d)
+
+
+def show_chunks(maze, x=None, y=None):
+    """
+    Show only the chunks with a cell within VIEW_RADIUS of (x, y), in cells, or all of them if x
+    is None. Only the chunks in the square around the view and those shown before are looked at,
+    so the cost doesn't grow with the maze.
+    """
+    if x is None:
+        shown = None
+        keys = maze.chunks3d.keys() | maze.dirty3d
+    else:
+        shown = set()
+        chunkRows = range(max(0, int(y - VIEW_RADIUS) // CHUNK_SIZE),
+                          min(-(-maze.height // CHUNK_SIZE), int(y + VIEW_RADIUS) // CHUNK_SIZE + 1))
+        chunkCols = range(max(0, int(x - VIEW_RADIUS) // CHUNK_SIZE),
+                          min(-(-maze.width // CHUNK_SIZE), int(x + VIEW_RADIUS) // CHUNK_SIZE + 1))
+        for chunkRow in chunkRows:
+            # Distance to the nearest point of the chunk
+            top = chunkRow * CHUNK_SIZE
+            dy = max(top - y, 0, y - top - CHUNK_SIZE)
+            for chunkCol in chunkCols:
+                left = chunkCol * CHUNK_SIZE
+                dx = max(left - x, 0, x - left - CHUNK_SIZE)
+                if dx * dx + dy * dy <= VIEW_RADIUS * VIEW_RADIUS:
+                    shown.add((chunkRow, chunkCol))
+        keys = shown if maze.shown3d is None else shown | maze.shown3d
+
+    maze.shown3d = shown
+    for key in keys:
+        update_chunk(maze, key)
+
+
+def cell_walls(maze, col, row):
+    """
+    :return: Wall bits of the cell at (col, row), 0 outside the maze
+    """
+    if 0 <= col < maze.width and 0 <= row < maze.height:
+        return maze.wallBits[row * maze.width + col]
+    return 0
+
+
+def wall_segments(maze, col, row):
+    """
+    :return: ((x0, y0), (x1, y1)) ends of each wall standing around the cell at (col, row) and its
+             eight neighbours, in cells with x0 <= x1 and y0 <= y1. Walls shared by two cells are
+             listed twice.
+    """
+    segments = []
+    for cellRow in range(row - 1, row + 2):
+        for cellCol in range(col - 1, col + 2):
+            walls = cell_walls(maze, cellCol, cellRow)
+            if walls >> Cell.EAST & 1:
+                segments.append(((cellCol + 1, cellRow), (cellCol + 1, cellRow + 1)))
+            if walls >> Cell.SOUTH & 1:
+                segments.append(((cellCol, cellRow + 1), (cellCol + 1, cellRow + 1)))
+            if walls >> Cell.WEST & 1:
+                segments.append(((cellCol, cellRow), (cellCol, cellRow + 1)))
+            if walls >> Cell.NORTH & 1:
+                segments.append(((cellCol, cellRow), (cellCol + 1, cellRow)))
+    return segments
+
+
+def walk(maze, x, y, dx, dy):
+    """
+    Move a player at (x, y) by (dx, dy), all in cells, sliding along the walls and keeping
+    PLAYER_RADIUS from them. The walls are looked up in the wall bits of the cells around the
+    player, so this takes the same time in any maze, with no colliders. The player can't leave
+    the floor, even through the entrance or exit.
+
+    :return: The new (x, y)
+    """
+    radius = PLAYER_RADIUS
+    # A step shorter than the radius can reach a wall but not get past it, so longer moves are split
+    count = math.ceil(math.hypot(dx, dy) / (radius / 2)) or 1
+    for _step in range(count):
+        fromX, fromY = x, y
+        x = max(radius, min(maze.width - radius, x + dx / count))
+        y = max(radius, min(maze.height - radius, y + dy / count))
+
+        # Pushing off one wall can push into another at a corner, so go round until none is too close
+        segments = wall_segments(maze, int(x), int(y))
+        for _attempt in range(4):
+            pushed = False
+            for (x0, y0), (x1, y1) in segments:
+                offsetX = x - max(x0, min(x1, x))
+                offsetY = y - max(y0, min(y1, y))
+                distance = math.hypot(offsetX, offsetY)
+                if distance >= radius:
+                    continue
+                if distance == 0:
+                    # On the wall, so back out to the side the step came from
+                    offsetX = fromX - max(x0, min(x1, fromX))
+                    offsetY = fromY - max(y0, min(y1, fromY))
+                    distance = math.hypot(offsetX, offsetY)
+                    if distance == 0:
+                        continue
+                x += offsetX * (radius / distance - 1)
+                y += offsetY * (radius / distance - 1)
+                pushed = True
+            if not pushed:
+                break
+
+    return x, y
+
+
+class Walkthrough:
+    """
+    First person view from a player walking through the maze. The player is kept in cells, x
+    along the rows and y down the columns, and the camera is put at that point of the floor,
+    however the floor is turned.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+        start = maze.start or (0, 0)
+        self.x = start[1] + 0.5
+        self.y = start[0] + 0.5
+        # Degrees clockwise from east, as the directions go, facing into the maze from the entrance
+        entrance = Cell.WEST if maze.entrance is None else maze.entrance
+        self.heading = 90 * Cell.OPPOSITE[entrance]
+        self.cell = None
+        self.saved = (camera.position, camera.rotation, camera.clip_plane_near)
+
+        cellWidth, cellHeight, _floorPosition, _floorScale = floor_geometry(maze)
+        camera.clip_plane_near = min(cellWidth, cellHeight) / 20
+        self.place()
+
+    def close(self):
+        camera.position, camera.rotation, camera.clip_plane_near = self.saved
+        show_chunks(self.maze)
+
+    def floor_position(self, x, y, height):
+        """
+        :return: World position of a point height cells above the floor at (x, y)
+        """
+        cellWidth, cellHeight, _floorPosition, floorScale = floor_geometry(self.maze)
+        point = floor_point(self.maze, Vec3(cellWidth * x - 1, cellHeight * y - 1,
+                                            floorScale[2] / 2 + height * min(cellWidth, cellHeight)))
+        return Vec3(*scene.getRelativePoint(self.maze.floor, point))
+
+    def update(self, dt):
+        self.heading += (held_keys['d'] + held_keys['right arrow'] - held_keys['a'] - held_keys['left arrow']) * TURN_SPEED * dt
+        forward = (held_keys['w'] + held_keys['up arrow'] - held_keys['s'] - held_keys['down arrow']) * WALK_SPEED * dt
+        if forward:
+            angle = math.radians(self.heading)
+            self.x, self.y = walk(self.maze, self.x, self.y, forward * math.cos(angle), forward * math.sin(angle))
+        self.place()
+
+    def place(self):
+        maze = self.maze
+        cell = (int(self.x), int(self.y))
+        if cell != self.cell:
+            self.cell = cell
+            show_chunks(maze, self.x, self.y)
+
+        angle = math.radians(self.heading)
+        camera.world_position = self.floor_position(self.x, self.y, EYE_HEIGHT)
+        camera.look_at(self.floor_position(self.x + math.cos(angle), self.y + math.sin(angle), EYE_HEIGHT),
+                       up=Vec3(*scene.getRelativeVector(maze.floor, (0, 0, 1))))
+
+        if maze.finish is not None and cell == (maze.finish[1], maze.finish[0]):
+            info.text = 'Found the way out'
+        else:
+            info.text = 'w s to walk, a d to turn, tab to leave'
+
+
 app = Ursina()
 
 window.title = 'Mazes'
@@ -109,19 +345,20 @@ window.cog_button.enabled = True
 
 
 def draw(maze):
+    # The walls are rebuilt by update() on the main thread
     time.sleep(maze.width * maze.height / 1000)
-    generate_walls(maze)
     
 maze = Maze(10, 10)
 floor = generate_walls(maze)
 
-thread = threading.Thread(target=lambda: maze.randomizeBacktracker(callback=lambda: draw(maze)))
+algorithm = sys.argv[1] if len(sys.argv) > 1 else 'backtracker'
+thread = threading.Thread(target=lambda: maze.generate(algorithm, callback=lambda: draw(maze)))
 thread.start()
 
 
 Text.scale = 0.05
 Text.default_resolution = 1080 * Text.scale
-info = Text(text="Box", color=color.white)
+info = Text(text="tab to walk through", color=color.white)
 info.x = -0.5
 info.y = 0.4
 info.background = True
@@ -132,13 +369,31 @@ floor.rotation_y = 190
 
 
 
+walkthrough = None
+
+
+def input(key):
+    global walkthrough
+    if key == 'tab':
+        if walkthrough is None:
+            walkthrough = Walkthrough(maze)
+        else:
+            walkthrough.close()
+            walkthrough = None
+            info.text = 'tab to walk through'
+
+
 def update():   # update gets automatically called.
+    generate_walls(maze)
+    if walkthrough is not None:
+        walkthrough.update(time.dt)
+        return
+
     floor.x += held_keys['d'] * .1
     floor.x -= held_keys['a'] * .1
     #floor.rotation_y += time.dt * 100
     #floor.rotation_x += time.dt * 10
     floor.rotation_z += time.dt * 10
-    generate_walls(maze)
     
        
 app.run()
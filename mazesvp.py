@@ -3,121 +3,226 @@
 from vpython import *
 import logging
 import sys
-from mazegen import Maze, Cell
+import time
+from mazegen import Maze, Cell, GENERATORS
 
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
+# In merged mode the walls of each square block of cells are one compound object
+BLOCK_SIZE = 8
+
+# Cell labels are only shown this many cells around the point the camera looks at
+LABEL_RADIUS = 4
+
+# Most times a second merged blocks are rebuilt while a maze is being generated
+BLOCK_RATE = 20
+
 class MazePv:
     def generate_walls(self, maze):
         """
         :param maze: The maze to generate walls for
-        :return: List of walls as list of list of vertices (in -1..1 for x,y,z)
     
         For each cell, only the east and south walls are created,
-        except for first row and column, for which the north and west are added respectively
+        except for first row and column, for which the north and west are added respectively.
+        Only the cells changed since the last call are updated, using the maze change tracking.
+        """
+        if not 'version3d' in maze.__dict__:
+            maze.version3d = -1
+            maze.blocks3d = {}
+            maze.labels3d = {}
+            maze.labelCentre = None
+            maze.trackChanges()
+
+        maze.version3d, changed = maze.changedSince(maze.version3d)
+        maze.trimChanges(maze.version3d)
+
+        if changed is None:
+            changed = range(maze.width * maze.height)
+
+        if self.mergedWidget.checked:
+            self.sync_blocks(maze, changed)
+        else:
+            for index in changed:
+                self.sync_cell(maze, *divmod(index, maze.width))
+
+        self.sync_labels(maze)
+
+    def wall_geometry(self, maze, rowIndex, cellIndex):
+        """
+        :return: Dictionary of direction to (pos, size) for the walls of a cell that should be drawn
         """
         cellWidth = 2 / maze.width
         cellHeight = 2 / maze.height
         wallWidth = 0.01
         wallHeight = 1
-        
-        for rowIndex, row in enumerate(maze.cells):
-            for cellIndex, cell in enumerate(row):
-                cellTopY = cellWidth * rowIndex - 1
-                cellLeftX = cellHeight * cellIndex -1
-                
-                if not 'walls3d' in cell.__dict__:
-                    cell.walls3d = {}
-                    cell.text = text(pos=vector(cellLeftX + cellWidth / 2,
-                                    cellTopY + cellHeight / 2 - cellHeight / 6,
-                                    0.1
-                                    ),
-                                    text=f"{rowIndex},{cellIndex}",
-                                    align='center',
-                                    height=cellWidth / 3,
-                                    color=color.red)
-                    
-                # ------------------
-            
-                if cell.walls[Cell.EAST] and not Cell.EAST in cell.walls3d:
-                    cell.walls3d[Cell.EAST] = box(pos=vector(cellLeftX + cellWidth - wallWidth / 2,
-                                              cellTopY + cellHeight / 2,
-                                              wallHeight / 2),
-                                    size=vector(wallWidth, cellHeight, wallHeight)
-                                   )
-                elif not cell.walls[Cell.EAST] and Cell.EAST in cell.walls3d:
-                    cell.walls3d.pop(Cell.EAST).visible = False
-    
-                # ------------------
-    
-                if cell.walls[Cell.SOUTH] and not Cell.SOUTH in cell.walls3d:
-                    cell.walls3d[Cell.SOUTH] = box(pos=vector(cellLeftX + cellHeight / 2,
-                                              cellTopY + cellWidth - wallWidth / 2,
-                                              wallHeight / 2),
-                                    size=vector(cellWidth, wallWidth, wallHeight)
-                                   )
-                elif not cell.walls[Cell.SOUTH] and Cell.SOUTH in cell.walls3d:
-                    cell.walls3d.pop(Cell.SOUTH).visible = False
-    
-                # ------------------
-    
-                if cell.walls[Cell.WEST] and cellIndex == 0 and not Cell.WEST in cell.walls3d:
-                    cell.walls3d[Cell.WEST] = box(pos=vector(cellLeftX - wallWidth / 2,
-                                              cellTopY + cellHeight / 2,
-                                              wallHeight / 2),
-                                    size=vector(wallWidth, cellHeight, wallHeight)
-                                   )
-                elif not cell.walls[Cell.WEST] and Cell.WEST in cell.walls3d:
-                    cell.walls3d.pop(Cell.WEST).visible = False
-    
-                # ------------------
-                    
-                if cell.walls[Cell.NORTH] and rowIndex == 0 and not Cell.NORTH in cell.walls3d:
-                    cell.walls3d[Cell.NORTH] = box(pos=vector(cellLeftX + cellWidth / 2,
-                                              cellTopY - wallWidth / 2,
-                                              wallHeight / 2),
-                                    size=vector(cellWidth, wallWidth, wallHeight)
-                                   )
-                elif not cell.walls[Cell.NORTH] and Cell.NORTH in cell.walls3d:
-                    cell.walls3d.pop(Cell.NORTH).visible = False
+        walls = maze.wallBits[rowIndex * maze.width + cellIndex]
+
+        cellTopY = cellWidth * rowIndex - 1
+        cellLeftX = cellHeight * cellIndex -1
+        geometry = {}
+
+        if walls & (1 << Cell.EAST):
+            geometry[Cell.EAST] = (vector(cellLeftX + cellWidth - wallWidth / 2,
+                                          cellTopY + cellHeight / 2,
+                                          wallHeight / 2),
+                                   vector(wallWidth, cellHeight, wallHeight))
+
+        if walls & (1 << Cell.SOUTH):
+            geometry[Cell.SOUTH] = (vector(cellLeftX + cellHeight / 2,
+                                           cellTopY + cellWidth - wallWidth / 2,
+                                           wallHeight / 2),
+                                    vector(cellWidth, wallWidth, wallHeight))
+
+        if walls & (1 << Cell.WEST) and cellIndex == 0:
+            geometry[Cell.WEST] = (vector(cellLeftX - wallWidth / 2,
+                                          cellTopY + cellHeight / 2,
+                                          wallHeight / 2),
+                                   vector(wallWidth, cellHeight, wallHeight))
+
+        if walls & (1 << Cell.NORTH) and rowIndex == 0:
+            geometry[Cell.NORTH] = (vector(cellLeftX + cellWidth / 2,
+                                           cellTopY - wallWidth / 2,
+                                           wallHeight / 2),
+                                    vector(cellWidth, wallWidth, wallHeight))
+
+        return geometry
+
+    def sync_cell(self, maze, rowIndex, cellIndex):
+        """
+        Create or hide the wall boxes of one cell to match its walls
+        """
+        cell = maze.cells[rowIndex][cellIndex]
+        if not 'walls3d' in cell.__dict__:
+            cell.walls3d = {}
+
+        geometry = self.wall_geometry(maze, rowIndex, cellIndex)
+        for direction in range(4):
+            if direction in geometry and not direction in cell.walls3d:
+                pos, size = geometry[direction]
+                cell.walls3d[direction] = box(pos=pos, size=size)
+            elif not direction in geometry and direction in cell.walls3d:
+                cell.walls3d.pop(direction).visible = False
+
+    def sync_blocks(self, maze, changed):
+        """
+        Rebuild the compound object of every block holding a changed cell
+        """
+        blocks = {(index // maze.width // BLOCK_SIZE, index % maze.width // BLOCK_SIZE) for index in changed}
+
+        for blockRow, blockCol in blocks:
+            old = maze.blocks3d.pop((blockRow, blockCol), None)
+            if old is not None:
+                old.visible = False
+
+            walls = []
+            for rowIndex in range(blockRow * BLOCK_SIZE, min(maze.height, (blockRow + 1) * BLOCK_SIZE)):
+                for cellIndex in range(blockCol * BLOCK_SIZE, min(maze.width, (blockCol + 1) * BLOCK_SIZE)):
+                    for pos, size in self.wall_geometry(maze, rowIndex, cellIndex).values():
+                        walls.append(box(pos=pos, size=size))
+
+            if len(walls) > 1:
+                maze.blocks3d[(blockRow, blockCol)] = compound(walls)
+            elif walls:
+                maze.blocks3d[(blockRow, blockCol)] = walls[0]
+
+    def sync_labels(self, maze):
+        """
+        Show row,col labels only for the cells near the centre of the view, if they are turned on
+        """
+        cellWidth = 2 / maze.width
+        cellHeight = 2 / maze.height
+
+        if not self.labelsWidget.checked:
+            centre = None
+        else:
+            centre = (int((self.scene.center.y + 1) / cellWidth), int((self.scene.center.x + 1) / cellHeight))
+
+        if centre == maze.labelCentre:
+            return
+        maze.labelCentre = centre
+
+        wanted = set()
+        if centre is not None:
+            for rowIndex in range(max(0, centre[0] - LABEL_RADIUS), min(maze.height, centre[0] + LABEL_RADIUS + 1)):
+                for cellIndex in range(max(0, centre[1] - LABEL_RADIUS), min(maze.width, centre[1] + LABEL_RADIUS + 1)):
+                    wanted.add((rowIndex, cellIndex))
+
+        for key in set(maze.labels3d) - wanted:
+            maze.labels3d.pop(key).visible = False
+
+        for rowIndex, cellIndex in wanted - set(maze.labels3d):
+            cellTopY = cellWidth * rowIndex - 1
+            cellLeftX = cellHeight * cellIndex -1
+            maze.labels3d[(rowIndex, cellIndex)] = text(pos=vector(cellLeftX + cellWidth / 2,
+                                                                   cellTopY + cellHeight / 2 - cellHeight / 6,
+                                                                   0.1
+                                                                   ),
+                                                        text=f"{rowIndex},{cellIndex}",
+                                                        align='center',
+                                                        height=cellWidth / 3,
+                                                        color=color.red)
     
     #------------------------------------------------------------------------------------------
     
     def draw(self, maze):
         rate(maze.width * maze.height / 10)
-        self.generate_walls(maze)
+        # Rebuilding a block makes a new compound, so in merged mode the changes of many steps are
+        # gathered by the change tracking and each changed block is rebuilt once for all of them
+        now = time.monotonic()
+        if not self.mergedWidget.checked or now - self.lastSync >= 1 / BLOCK_RATE:
+            self.lastSync = now
+            self.generate_walls(maze)
         
     def deleteMaze(self, maze):
-        for _rowIndex, row in enumerate(maze.cells):
-            for _cellIndex, cell in enumerate(row):
-                if 'walls3d' in cell.__dict__:
-                    cell.text.visible = False
-                    
-                    for _dir, wall in cell.walls3d:
-                        wall.visible = False
-
-                    cell.walls3d = None
+        """
+        Hide everything drawn for a maze and drop the references, so VPython can release it
+        """
+        for cell in maze.cellViews.values():
+            if 'walls3d' in cell.__dict__:
+                for wall in cell.walls3d.values():
+                    wall.visible = False
+                del cell.walls3d
+
+        if 'version3d' in maze.__dict__:
+            for block in maze.blocks3d.values():
+                block.visible = False
+            for label in maze.labels3d.values():
+                label.visible = False
+            del maze.blocks3d
+            del maze.labels3d
+            del maze.version3d
     #------------------------------------------------------------------------------------------
     
     def generate(self, _p):
         if self.maze:
             self.deleteMaze(self.maze);
+            self.maze = None
         
         self.maze = Maze(int(self.widthWidget.text), int(self.heightWidget.text))
         self.generate_walls(self.maze)
-        self.maze.randomizeBacktracker(loops = int(self.loopWidget.text), callback=lambda: self.draw(self.maze))
+        self.maze.generate(self.algorithmWidget.selected, loops = int(self.loopWidget.text),
+                           callback=lambda: self.draw(self.maze))
         self.generate_walls(self.maze)
+
+    def redraw(self, _widget=None):
+        """
+        Rebuild the view after switching between merged and separate walls, or labels on and off
+        """
+        if self.maze:
+            self.deleteMaze(self.maze)
+            self.generate_walls(self.maze)
         
-    def what(self):
+    def what(self, _widget=None):
         pass
     
     #------------------------------------------------------------------------------------------
     
     def __init__(self):
         self.maze = None
-        scene = canvas(title='Mazes',
+        self.lastSync = 0
+        self.scene = scene = canvas(title='Mazes',
                        width=1000, height=800,
                        center=vector(0,0,-5), background=color.cyan)
         
@@ -130,10 +235,17 @@ class MazePv:
         self.heightWidget = winput(prompt="Height", text="10", type="numeric", bind=self.what)
         wtext(text="&nbsp;Loops:")
         self.loopWidget = winput(prompt="Loops", text="0", type="numeric", bind=self.what)
+        wtext(text="&nbsp;Algorithm:")
+        self.algorithmWidget = menu(choices=list(GENERATORS), selected='backtracker', bind=self.what)
+        self.mergedWidget = checkbox(text="Merged walls", checked=True, bind=self.redraw)
+        self.labelsWidget = checkbox(text="Labels", checked=False, bind=self.redraw)
         button(bind=self.generate, text="Generate")
         scene.append_to_caption('\n\n')    
+
+        # Labels follow the point the camera looks at
+        scene.bind('mouseup', lambda _event: self.maze and self.sync_labels(self.maze))
         
 #------------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    MazePv()
\ No newline at end of file
+    MazePv()
@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Grid shapes for mazes - which cells are next to which, and where each cell is drawn.
+
+Directions are bit numbers in the wall masks of the cells, going clockwise, so a maze with up
+to 8 directions still has one byte per cell:
+  rect, torus - EAST, SOUTH, WEST, NORTH as in mazegen.Cell. A torus wraps round both ways.
+  hex         - HexTopology.EAST, SOUTH_EAST, SOUTH_WEST, WEST, NORTH_WEST, NORTH_EAST, in rows of
+                pointy topped hexagons with the odd rows shifted half a cell east
+  levels      - the rect directions on each level, with UP and DOWN to the levels above and
+                below. The levels are stacked as rows, level 0 first, so (row, col) positions and
+                cell indexes work as for a flat maze of height * levels rows.
+
+The neighbour index is built once per shape, by getTopology, and shared by every maze of that
+shape. Cells are sorted into classes by which edges of the grid they are on, and whether their
+row is odd, and the index is a compressed sparse row table of (direction, index offset) links
+whose rows are the classes rather than the cells. The neighbour of a cell is its index plus the
+offset. cellClass holds the class of every cell, so the whole index costs a byte per cell, and
+is made with bytes operations a row at a time.
+"""
+
+import math
+from array import array
+from functools import lru_cache
+
+EAST = 0
+SOUTH = 1
+WEST = 2
+NORTH = 3
+
+# Cell class bits
+FIRST_COL = 1
+LAST_COL = 2
+FIRST_ROW = 4
+LAST_ROW = 8
+ODD_ROW = 16
+FIRST_LEVEL = 32
+LAST_LEVEL = 64
+CLASS_COUNT = 128
+
+RECT_STEPS = {EAST: (0, 1), SOUTH: (1, 0), WEST: (0, -1), NORTH: (-1, 0)}
+
+
+class Topology:
+    """
+    Rectangular grid, the shape every maze had before there were others.
+
+    Neighbour index:
+      cellClass     - bytes, the class of each cell
+      linkStart     - array, the links of class c are linkStart[c] to linkStart[c + 1]
+      linkDirection - bytes, direction of each link
+      linkOffset    - array, index offset of each link
+      links         - the same as a tuple of ((direction, offset), ...) per class, for inner loops
+      steps         - tuple per class of the offset in each direction, None where there's no neighbour
+    """
+
+    name = 'rect'
+    directions = 4
+    # One of each pair of opposite directions, each wall is counted once as one of these
+    forward = (EAST, SOUTH)
+    opposite = (WEST, NORTH, EAST, SOUTH)
+    # Directions a wall follower turns through, the rest go to other levels
+    turns = 4
+    # Order the links of a cell are listed in, which is the order the generators have always
+    # tried the neighbours of a cell in, so the same seed still carves the same maze
+    order = (WEST, EAST, NORTH, SOUTH)
+    # Default walls of the start and finish cells opened to the outside
+    entrance = WEST
+    exit = EAST
+
+    def __init__(self, width, height, levels=1):
+        self.width = width
+        self.height = height
+        self.levels = levels
+        self.rows = height * levels
+        self.cells = width * self.rows
+        self.allWalls = (1 << self.directions) - 1
+        # Wall masks of dead ends, cells with exactly one wall open
+        self.deadEnds = bytes(bin(value & self.allWalls).count('1') == self.directions - 1 for value in range(256))
+        self.cellClass = self.classify()
+
+        self.linkStart = array('i', [0])
+        self.linkDirection = bytearray()
+        self.linkOffset = array('i')
+        steps = []
+        for cellClass in range(CLASS_COUNT):
+            offsets = [None] * self.directions
+            for direction in self.order:
+                offset = self.offset(cellClass, direction)
+                if offset is not None:
+                    offsets[direction] = offset
+                    self.linkDirection.append(direction)
+                    self.linkOffset.append(offset)
+            self.linkStart.append(len(self.linkOffset))
+            steps.append(tuple(offsets))
+        self.linkDirection = bytes(self.linkDirection)
+        self.steps = tuple(steps)
+        self.links = tuple(tuple(zip(self.linkDirection[self.linkStart[cellClass]:self.linkStart[cellClass + 1]],
+                                     self.linkOffset[self.linkStart[cellClass]:self.linkStart[cellClass + 1]]))
+                           for cellClass in range(CLASS_COUNT))
+        self.linkMasks = {}
+
+    def classify(self):
+        """
+        :return: bytes of the class of every cell
+        """
+        pattern = bytearray(self.width)
+        pattern[0] |= FIRST_COL
+        pattern[-1] |= LAST_COL
+        rows = {}
+        classes = bytearray()
+        for level in range(self.levels):
+            for row in range(self.height):
+                flags = (FIRST_ROW if row == 0 else 0) | (LAST_ROW if row == self.height - 1 else 0) | \
+                        (ODD_ROW if row & 1 else 0) | (FIRST_LEVEL if level == 0 else 0) | \
+                        (LAST_LEVEL if level == self.levels - 1 else 0)
+                line = rows.get(flags)
+                if line is None:
+                    line = rows[flags] = pattern.translate(bytes(value | flags for value in range(256)))
+                classes += line
+        return bytes(classes)
+
+    def step(self, cellClass, rowInc, colInc):
+        """
+        :return: Index offset of the cell rowInc rows and colInc columns away on the same level,
+                 None if that is off the grid
+        """
+        if colInc < 0 and cellClass & FIRST_COL or colInc > 0 and cellClass & LAST_COL or \
+                rowInc < 0 and cellClass & FIRST_ROW or rowInc > 0 and cellClass & LAST_ROW:
+            return None
+        return rowInc * self.width + colInc
+
+    def offset(self, cellClass, direction):
+        """
+        :return: Index offset to the neighbour in direction of a cell of class cellClass, None if there is none
+        """
+        return self.step(cellClass, *RECT_STEPS[direction])
+
+    def neighbour(self, index, direction):
+        """
+        :return: Index of the neighbour in direction, -1 if there is none
+        """
+        offset = self.steps[self.cellClass[index]][direction]
+        return -1 if offset is None else index + offset
+
+    def neighbours(self, index):
+        """
+        :return: List of (direction, neighbour index) of the cell at index
+        """
+        return [(direction, index + offset) for direction, offset in self.links[self.cellClass[index]]]
+
+    def linked(self, direction):
+        """
+        :return: bytes with a 1 for every cell that has a neighbour in direction, made once
+        """
+        mask = self.linkMasks.get(direction)
+        if mask is None:
+            table = bytes(self.steps[cellClass][direction] is not None if cellClass < CLASS_COUNT else 0
+                          for cellClass in range(256))
+            mask = self.linkMasks[direction] = self.cellClass.translate(table)
+        return mask
+
+    def distanceTo(self, target):
+        """
+        :return: Function of a cell index giving a lower bound on the steps from it to target,
+                 as the A* heuristic
+        """
+        width = self.width
+        targetRow, targetCol = divmod(target, width)
+        return lambda index: abs(index // width - targetRow) + abs(index % width - targetCol)
+
+    # Geometry for drawing, in units of a cell width with y going down
+
+    def position(self, index):
+        """
+        :return: (level, row within the level, col) of the cell at index
+        """
+        row, col = divmod(index, self.width)
+        level, row = divmod(row, self.height)
+        return level, row, col
+
+    def extent(self):
+        """
+        :return: (width, height) of the drawing of the whole grid
+        """
+        return self.width, self.height
+
+    def centre(self, index):
+        """
+        :return: (x, y) of the middle of the cell at index
+        """
+        row, col = divmod(index, self.width)
+        return col + 0.5, row + 0.5
+
+    def corners(self, index):
+        """
+        :return: Corners of the cell at index going clockwise, such that its wall in direction d
+                 runs from corner d to the next one
+        """
+        row, col = divmod(index, self.width)
+        return [(col + 1, row), (col + 1, row + 1), (col, row + 1), (col, row)]
+
+    def wallEnds(self, index, direction):
+        """
+        :return: ((x, y), (x, y)) ends of the wall of the cell at index in direction, None for
+                 directions that aren't drawn, such as up and down
+        """
+        corners = self.corners(index)
+        if direction >= len(corners):
+            return None
+        return corners[direction], corners[(direction + 1) % len(corners)]
+
+
+class TorusTopology(Topology):
+    """
+    Rectangular grid that wraps round, east to west and south to north. A side only one cell
+    across doesn't wrap, since a cell can't be its own neighbour.
+    """
+
+    name = 'torus'
+
+    def offset(self, cellClass, direction):
+        width = self.width
+        if direction == EAST and cellClass & LAST_COL:
+            return -(width - 1) or None
+        if direction == WEST and cellClass & FIRST_COL:
+            return width - 1 or None
+        if direction == SOUTH and cellClass & LAST_ROW:
+            return -(self.height - 1) * width or None
+        if direction == NORTH and cellClass & FIRST_ROW:
+            return (self.height - 1) * width or None
+        return super().offset(cellClass, direction)
+
+    def distanceTo(self, target):
+        width = self.width
+        height = self.height
+        targetRow, targetCol = divmod(target, width)
+
+        def distance(index):
+            rows = abs(index // width - targetRow)
+            cols = abs(index % width - targetCol)
+            return min(rows, height - rows) + min(cols, width - cols)
+        return distance
+
+
+class HexTopology(Topology):
+    """
+    Hexagonal cells, in rows with the odd rows shifted half a cell east
+    """
+
+    EAST = 0
+    SOUTH_EAST = 1
+    SOUTH_WEST = 2
+    WEST = 3
+    NORTH_WEST = 4
+    NORTH_EAST = 5
+
+    # (row, col) steps to the neighbours in each direction from an even row, then from an odd one
+    EVEN_STEPS = ((0, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0))
+    ODD_STEPS = ((0, 1), (1, 1), (1, 0), (0, -1), (-1, 0), (-1, 1))
+
+    # Distance from the middle of a cell to its corners, when cells are one unit across
+    RADIUS = 1 / math.sqrt(3)
+
+    name = 'hex'
+    directions = 6
+    forward = (EAST, SOUTH_EAST, SOUTH_WEST)
+    opposite = (WEST, NORTH_WEST, NORTH_EAST, EAST, SOUTH_EAST, SOUTH_WEST)
+    turns = 6
+    order = (WEST, EAST, NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST)
+    entrance = WEST
+    exit = EAST
+
+    def offset(self, cellClass, direction):
+        steps = self.ODD_STEPS if cellClass & ODD_ROW else self.EVEN_STEPS
+        return self.step(cellClass, *steps[direction])
+
+    def distanceTo(self, target):
+        # Hex distance in axial coordinates, where the column is skewed by half the row
+        width = self.width
+        targetRow, targetCol = divmod(target, width)
+        targetQ = targetCol - (targetRow >> 1)
+
+        def distance(index):
+            row, col = divmod(index, width)
+            rows = row - targetRow
+            cols = col - (row >> 1) - targetQ
+            return max(abs(rows), abs(cols), abs(rows + cols))
+        return distance
+
+    def extent(self):
+        return self.width + (0.5 if self.height > 1 else 0), self.RADIUS * (2 + 1.5 * (self.height - 1))
+
+    def centre(self, index):
+        row, col = divmod(index, self.width)
+        return col + 0.5 + 0.5 * (row & 1), self.RADIUS * (1 + 1.5 * row)
+
+    def corners(self, index):
+        x, y = self.centre(index)
+        radius = self.RADIUS
+        # Starting at the upper right corner, where the east wall begins
+        return [(x + radius * math.cos(math.radians(angle)), y + radius * math.sin(math.radians(angle)))
+                for angle in range(-30, 330, 60)]
+
+
+class LevelsTopology(Topology):
+    """
+    Rectangular grids stacked as levels, with passages up and down between them
+    """
+
+    UP = 4
+    DOWN = 5
+
+    name = 'levels'
+    directions = 6
+    forward = (EAST, SOUTH, UP)
+    opposite = (WEST, NORTH, EAST, SOUTH, DOWN, UP)
+    order = (WEST, EAST, NORTH, SOUTH, UP, DOWN)
+
+    def offset(self, cellClass, direction):
+        if direction == self.UP:
+            return None if cellClass & LAST_LEVEL else self.width * self.height
+        if direction == self.DOWN:
+            return None if cellClass & FIRST_LEVEL else -self.width * self.height
+        return super().offset(cellClass, direction)
+
+    def distanceTo(self, target):
+        width = self.width
+        height = self.height
+        targetLevel, targetRow = divmod(target // width, height)
+        targetCol = target % width
+
+        def distance(index):
+            level, row = divmod(index // width, height)
+            return abs(level - targetLevel) + abs(row - targetRow) + abs(index % width - targetCol)
+        return distance
+
+    # Levels are drawn one under another, a row apart
+
+    def extent(self):
+        return self.width, self.levels * (self.height + 1) - 1
+
+    def centre(self, index):
+        x, y = super().centre(index)
+        return x, y + index // (self.width * self.height)
+
+    def corners(self, index):
+        gap = index // (self.width * self.height)
+        return [(x, y + gap) for x, y in super().corners(index)]
+
+
+TOPOLOGIES = {
+    'rect': Topology,
+    'torus': TorusTopology,
+    'hex': HexTopology,
+    'levels': LevelsTopology,
+}
+
+
+@lru_cache(maxsize=16)
+def getTopology(name, width, height, levels=1):
+    """
+    :param name: One of TOPOLOGIES
+    :param height: Rows of each level
+    :return: The shared topology of that name and shape
+    """
+    if name != 'levels' and levels != 1:
+        raise ValueError(f'The {name} topology has only one level')
+    return TOPOLOGIES[name](width, height, levels)
@@ -0,0 +1,13 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+The maze modules sit at the top of the repository rather than in a package, so make them
+importable however pytest is started.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
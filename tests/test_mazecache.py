@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Tests of the maze cache, in memory and on disk.
+"""
+
+import os
+import threading
+import time
+
+import mazecache
+from mazecache import MazeCache, specKey
+from mazebatch import generateState
+
+
+def spec(seed, width=20, height=15):
+    return {'width': width, 'height': height, 'seed': seed}
+
+
+def test_hit_returns_the_generated_maze():
+    cache = MazeCache()
+    state = cache.getState(spec(1))
+    assert state == generateState(mazecache.normalizeSpec(spec(1)))
+    assert cache.getState(spec(1)) == state
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_trims_to_max_entries():
+    cache = MazeCache(maxEntries=2)
+    cache.getState(spec(1))
+    cache.getState(spec(2))
+    cache.getState(spec(1))
+    cache.getState(spec(3))
+    assert list(cache.entries) == [specKey(spec(1)), specKey(spec(3))]
+    cache.getState(spec(2))
+    assert cache.misses == 4
+
+
+def test_lru_trims_to_max_bytes():
+    size = len(MazeCache().getState(spec(1))['walls'])
+    cache = MazeCache(maxBytes=size * 2)
+    for seed in range(5):
+        cache.getState(spec(seed))
+    assert len(cache.entries) == 2
+    assert cache.bytes == size * 2
+
+    # Results count too, and the newest entry stays even when it is over on its own
+    cache.distances(spec(4))
+    assert list(cache.entries) == [specKey(spec(4))]
+
+
+def test_concurrent_misses_generate_once(monkeypatch):
+    calls = []
+
+    def slowGenerate(normal):
+        calls.append(normal['seed'])
+        time.sleep(0.2)
+        return generateState(normal)
+
+    monkeypatch.setattr(mazecache, 'generateState', slowGenerate)
+    cache = MazeCache()
+    results = []
+    threads = [threading.Thread(target=lambda seed=seed: results.append(cache.getState(spec(seed % 2))))
+               for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(calls) == [0, 1]
+    assert len(results) == 8
+    assert (cache.hits, cache.misses) == (6, 2)
+
+
+def test_failed_generation_is_retried(monkeypatch):
+    def failing(normal):
+        raise RuntimeError('no maze')
+
+    cache = MazeCache()
+    monkeypatch.setattr(mazecache, 'generateState', failing)
+    try:
+        cache.getState(spec(1))
+    except RuntimeError:
+        pass
+    monkeypatch.setattr(mazecache, 'generateState', generateState)
+    assert cache.getState(spec(1))['seed'] == 1
+    assert not cache.pending
+
+
+def test_disk_entries_and_results(tmp_path):
+    cache = MazeCache(directory=str(tmp_path))
+    state = cache.getState(spec(1))
+    solution = cache.solution(spec(1))
+    key = specKey(spec(1))
+    assert sorted(os.listdir(tmp_path)) == [f'{key}.maze', f'{key}.solution-astar']
+
+    other = MazeCache(directory=str(tmp_path))
+    assert other.getState(spec(1))['walls'] == state['walls']
+    assert other.solution(spec(1)) == solution
+    assert other.misses == 0
+
+
+def test_truncated_disk_entry_is_made_again(tmp_path):
+    cache = MazeCache(directory=str(tmp_path))
+    state = cache.getState(spec(1))
+    path = cache.path(specKey(spec(1)))
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 10)
+
+    other = MazeCache(directory=str(tmp_path))
+    assert other.getState(spec(1)) == state
+    assert other.misses == 1
+    # Written whole again, so the next cache finds it
+    third = MazeCache(directory=str(tmp_path))
+    assert third.getState(spec(1))['walls'] == state['walls']
+    assert third.misses == 0
+
+
+def test_disk_trimmed_oldest_first(tmp_path):
+    cache = MazeCache(directory=str(tmp_path), maxDiskBytes=1)
+    for seed in range(3):
+        cache.getState(spec(seed))
+    # Only the entry just written is kept when nothing else fits
+    assert os.listdir(tmp_path) == [f'{specKey(spec(2))}.maze']
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Tests of the maze file format, replaying recorded steps and the solvers.
+"""
+
+import io
+
+import pytest
+
+from mazegen import Maze, MappedMaze, GENERATORS, SOLVERS, encodeHeader
+
+
+def makeMaze(width=23, height=17, algorithm='backtracker', seed=5, loops=0, topology='rect'):
+    maze = Maze(width, height, topology)
+    maze.generate(algorithm, seed=seed, loops=loops)
+    return maze
+
+
+def sameMaze(maze, other):
+    assert (other.width, other.height) == (maze.width, maze.height)
+    assert bytes(other.wallBits) == bytes(maze.wallBits)
+    assert (other.start, other.entrance, other.finish, other.exit) == \
+           (maze.start, maze.entrance, maze.finish, maze.exit)
+    assert (other.seed, other.algorithm) == (maze.seed, maze.algorithm)
+
+
+# ------------------------------------------------------------------------------------------
+# File format
+# ------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('topology', ['rect', 'torus', 'hex'])
+def test_state_round_trip(topology):
+    maze = makeMaze(topology=topology, loops=10)
+    sameMaze(maze, Maze.fromState(maze.getState()))
+
+
+@pytest.mark.parametrize('width', [1, 7, 8])
+def test_file_round_trip(tmp_path, width):
+    maze = makeMaze(width, 5, seed=-(1 << 100))
+    path = tmp_path / 'maze.maze'
+    maze.save(str(path))
+    sameMaze(maze, Maze.load(str(path)))
+
+    with Maze.load(str(path), mapped=True) as mapped:
+        for row in range(maze.height):
+            assert bytes(mapped.rowWalls(row)) == bytes(maze.wallBits[row * width:(row + 1) * width])
+            for col in range(width):
+                assert mapped.wallMask(row, col) == maze.wallBits[row * width + col]
+        sameMaze(maze, mapped.toMaze())
+
+
+def test_file_object_round_trip():
+    maze = makeMaze(seed=None)
+    file = io.BytesIO()
+    maze.save(file)
+    file.seek(0)
+    sameMaze(maze, Maze.load(file))
+
+
+@pytest.mark.parametrize('cut', [1, 10, 'header', 'walls'])
+def test_truncated_file_rejected(tmp_path, cut):
+    maze = makeMaze()
+    file = io.BytesIO()
+    maze.save(file)
+    data = file.getvalue()
+    header = len(encodeHeader(maze.getState()))
+    data = data[:{'header': header, 'walls': len(data) - 1}.get(cut, cut)]
+
+    with pytest.raises(ValueError, match='Truncated maze file'):
+        Maze.load(io.BytesIO(data))
+    path = tmp_path / 'short.maze'
+    path.write_bytes(data)
+    with pytest.raises(ValueError, match='Truncated maze file'):
+        MappedMaze(str(path))
+
+
+def test_not_a_maze_file():
+    with pytest.raises(ValueError, match='Not a maze file'):
+        Maze.load(io.BytesIO(b'PNG and then some more bytes than a maze header has' * 2))
+
+
+def test_seed_too_big_to_save():
+    maze = makeMaze(seed=1 << 127)
+    with pytest.raises(ValueError):
+        maze.save(io.BytesIO())
+
+
+# ------------------------------------------------------------------------------------------
+# Replay
+# ------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('topology', ['rect', 'torus', 'hex'])
+@pytest.mark.parametrize('algorithm', sorted(GENERATORS))
+def test_replay_matches_generate(algorithm, topology):
+    maze = makeMaze(19, 13, algorithm, seed=11, loops=15, topology=topology)
+    recorded = Maze(19, 13, topology)
+    steps = list(recorded.generateSteps(algorithm, seed=11, loops=15))
+    assert bytes(recorded.wallBits) == bytes(maze.wallBits)
+
+    replayed = Maze(19, 13, topology)
+    replayed.replay(steps)
+    assert bytes(replayed.wallBits) == bytes(maze.wallBits)
+
+
+# ------------------------------------------------------------------------------------------
+# Solvers
+# ------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('topology', ['rect', 'torus', 'hex'])
+@pytest.mark.parametrize('loops', [0, 40])
+@pytest.mark.parametrize('algorithm', sorted(GENERATORS))
+def test_solvers_agree(algorithm, loops, topology):
+    maze = makeMaze(31, 21, algorithm, seed=3, loops=loops, topology=topology)
+    start = maze.start[0] * maze.width + maze.start[1]
+    finish = maze.finish[0] * maze.width + maze.finish[1]
+    lengths = {}
+    for name in SOLVERS:
+        path = maze.solve(name)
+        assert (path[0], path[-1]) == (start, finish)
+        for index, following in zip(path, path[1:]):
+            assert any(maze.neighbourIndex(index, direction) == following and not maze.wallBits[index] >> direction & 1
+                       for direction in range(maze.topology.directions))
+        lengths[name] = len(path)
+    assert len(set(lengths.values())) == 1, lengths
+    assert lengths['bfs'] == maze.distanceField()[finish] + 1
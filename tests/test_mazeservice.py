@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Author: Shalom Crown
+Licence: GPL3
+
+Tests of the maze service, over TCP with real worker processes.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from mazegen import Maze
+from mazeservice import MazeService, MazeClient, ServiceError
+
+
+def runService(test, **options):
+    """
+    Run test(service, port) on a started service, closing it afterwards
+    """
+    async def main():
+        service = MazeService(workers=2, **options)
+        try:
+            server = await service.start(port=0)
+            await test(service, server.sockets[0].getsockname()[1])
+        finally:
+            await service.close()
+
+    asyncio.run(main())
+
+
+def test_identical_jobs_in_flight_are_merged():
+    async def test(service, _port):
+        results = await asyncio.gather(*(service.run('sleep', time.sleep, (0.3,)) for _ in range(4)))
+        assert results == [None] * 4
+        assert service.merged == 3
+        assert not service.inFlight
+
+    runService(test)
+
+
+def test_identical_requests_share_one_job():
+    spec = {'width': 200, 'height': 200, 'seed': 9}
+
+    async def test(service, port):
+        clients = [await MazeClient.connect(port=port) for _ in range(4)]
+        try:
+            mazes = await asyncio.gather(*(client.generate(spec) for client in clients))
+        finally:
+            for client in clients:
+                await client.close()
+        expected = Maze(200, 200)
+        expected.generate(seed=9)
+        for maze in mazes:
+            assert bytes(maze.wallBits) == bytes(expected.wallBits)
+        # All four usually arrive while the first is being made, but at least one surely does
+        assert service.merged >= 1
+
+    runService(test)
+
+
+def test_solve_and_render():
+    spec = {'width': 30, 'height': 20, 'seed': 4}
+
+    async def test(_service, port):
+        client = await MazeClient.connect(port=port)
+        try:
+            path = await client.solve(spec, 'bfs')
+            maze = await client.generate(spec)
+            assert path == list(maze.solve('bfs'))
+            image = await client.render(spec, 'png')
+            assert image.startswith(b'\x89PNG')
+        finally:
+            await client.close()
+
+    runService(test, chunkSize=256)
+
+
+def test_busy_and_bad_requests():
+    async def test(service, port):
+        client = await MazeClient.connect(port=port)
+        try:
+            with pytest.raises(ServiceError, match='positive integer'):
+                await client.generate({'width': 0, 'height': 5})
+            slow = asyncio.ensure_future(service.run('sleep', time.sleep, (0.3,)))
+            await asyncio.sleep(0)
+            with pytest.raises(ServiceError, match='busy'):
+                await service.run('other', time.sleep, (0,))
+            await slow
+            assert service.rejected == 1
+        finally:
+            await client.close()
+
+    runService(test, maxPending=1)